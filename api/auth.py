@@ -7,11 +7,14 @@ from eth_account.messages import encode_defunct
 from eth_account import Account
 from config import db, app
 from urllib.parse import urlparse
+from sqlalchemy import func, select
 import traceback
-from auth_utils import auth_required
+from auth_utils import auth_required, current_principal, invalidate_token
 
-from db_models import AuthChallenge, UserSession, User, PaymentIntent, PaymentStatus, PasskeyCredential, PasskeyChallenge
-from constants import USER_STARTING_QUOTA
+from db_models import UserSession, User, PaymentIntent, PaymentStatus, PasskeyCredential, PasskeyChallenge
+from ttl import purge_expired
+from rate_limit import rate_limit, client_ip
+from constants import USER_STARTING_QUOTA, REGISTER_RATE_LIMIT, PASSKEY_RATE_LIMIT
 
 # Add these imports for passkey functionality
 from cryptography.hazmat.primitives import hashes
@@ -41,42 +44,15 @@ def error_response(message: str, code: int = 400):
 def cleanup_expired_auth_records():
     """Deletes expired AuthChallenge, UserSession, and PasskeyChallenge records."""
     try:
-        now = datetime.utcnow()
-
-        expired_challenges = AuthChallenge.query.filter(
-            AuthChallenge.expires_at < now
-        ).count()
-        AuthChallenge.query.filter(
-            AuthChallenge.expires_at < now
-        ).delete()
-
-        expired_passkey_challenges = PasskeyChallenge.query.filter(
-            PasskeyChallenge.expires_at < now
-        ).count()
-        PasskeyChallenge.query.filter(
-            PasskeyChallenge.expires_at < now
-        ).delete()
-
-        expired_sessions = UserSession.query.filter(
-            UserSession.expires_at < now
-        ).count()
-        UserSession.query.filter(
-            UserSession.expires_at < now
-        ).delete()
-
-        db.session.commit()
-
-        if expired_challenges > 0 or expired_sessions > 0 or expired_passkey_challenges > 0:
-            app.logger.info(
-                f"Cleaned up {expired_challenges} auth challenges, "
-                f"{expired_passkey_challenges} passkey challenges, and "
-                f"{expired_sessions} expired sessions"
-            )
-    except Exception as e:
+        purged = purge_expired()
+    except Exception:
         db.session.rollback()
         app.logger.exception("Cleanup failed")
         raise
 
+    if any(purged.values()):
+        app.logger.info("Cleaned up " + ", ".join(f"{count} {label}" for label, count in purged.items()))
+
 # --- Passkey Utility Functions ---
 def generate_challenge() -> bytes:
     """Generate a cryptographically secure random challenge."""
@@ -302,6 +278,7 @@ def check_username():
         return error_response('Failed to check username', 500)
 
 @auth_bp.route('/passkey/challenge', methods=['POST'])
+@rate_limit('passkey', *PASSKEY_RATE_LIMIT)
 def get_passkey_challenge():
     """Generate and return just the challenge"""
     username = request.json.get('username')
@@ -327,6 +304,7 @@ def get_passkey_challenge():
     })
 
 @auth_bp.route('/passkey/register/complete', methods=['POST'])
+@rate_limit('passkey', *PASSKEY_RATE_LIMIT)
 def passkey_register_complete():
     """Complete passkey registration process."""
     try:
@@ -393,6 +371,7 @@ def passkey_register_complete():
             # Clean up challenge and old sessions
             db.session.delete(stored_challenge)
             old_sessions = db.session.query(UserSession).filter_by(user_id=user.user_id).all()
+            stale_tokens = [old_session.token for old_session in old_sessions]
             for old_session in old_sessions:
                 db.session.delete(old_session)
             
@@ -402,6 +381,9 @@ def passkey_register_complete():
             db.session.add(session_obj)
             
             db.session.commit()
+            # The deleted sessions may still be cached by this worker
+            for token in stale_tokens:
+                invalidate_token(token)
             
             app.logger.info(f"Created passkey for user: {username}")
             
@@ -423,10 +405,9 @@ def passkey_register_complete():
         return error_response('Failed to complete passkey registration', 500)
 
 @auth_bp.route('/passkey/authenticate/begin', methods=['POST'])
+@rate_limit('passkey', *PASSKEY_RATE_LIMIT)
 def passkey_authenticate_begin():
     try:
-        cleanup_expired_auth_records()
-        
         challenge = generate_challenge()
         challenge_id = f"passkey_auth:usernameless:{int(time.time())}"
         
@@ -458,6 +439,7 @@ def passkey_authenticate_begin():
         return error_response('Failed to start passkey authentication', 500)
 
 @auth_bp.route('/passkey/authenticate/complete', methods=['POST'])
+@rate_limit('passkey', *PASSKEY_RATE_LIMIT)
 def passkey_authenticate_complete():
     """Complete passkey authentication process."""
     try:
@@ -515,6 +497,7 @@ def passkey_authenticate_complete():
             # Clean up challenge and old sessions
             db.session.delete(stored_challenge)
             old_sessions = db.session.query(UserSession).filter_by(user_id=user.user_id).all()
+            stale_tokens = [old_session.token for old_session in old_sessions]
             for old_session in old_sessions:
                 db.session.delete(old_session)
 
@@ -523,6 +506,9 @@ def passkey_authenticate_complete():
             session_obj = UserSession(session_token, user.user_id, int(time.time()))
             db.session.add(session_obj)
             db.session.commit()
+            # The deleted sessions may still be cached by this worker
+            for token in stale_tokens:
+                invalidate_token(token)
             
             # Log success INSIDE the session context
             app.logger.info(f"Authentication successful for user: {user.username}")
@@ -550,51 +536,32 @@ def passkey_authenticate_complete():
 
 @auth_bp.route('/me', methods=['GET'])
 @auth_required 
-def auth_me(token):
+def auth_me(principal):
     try:
-        session = (
-            db.session.query(UserSession)
-            .filter_by(token=token)
-            .filter(UserSession.expires_at > datetime.utcnow())
+        # One indexed lookup; payment history is paged separately by GET /payments/history
+        purchased = (
+            select(func.coalesce(func.sum(PaymentIntent.amount), 0))
+            .where(PaymentIntent.user_id == User.user_id,
+                   PaymentIntent.status == PaymentStatus.CONFIRMED.value)
+            .scalar_subquery()
+        )
+        user = (
+            db.session.query(User.user_id, User.username, User.api_key, User.inbox_quota,
+                             purchased.label('purchased_quota'))
+            .filter_by(user_id=principal.user_id)
             .first()
         )
-
-        if not session:
-            return error_response('Invalid or expired authentication token', 401)
-
-        user = db.session.query(User).filter_by(user_id=session.user_id).first()
         if not user:
             return error_response('User not found', 404)
 
-        payments = (
-            db.session.query(PaymentIntent)
-            .filter_by(user_id=user.user_id, status=PaymentStatus.CONFIRMED.value)
-            .order_by(PaymentIntent.created_at.desc())
-            .all()
-        )
-
-        payment_data = [
-            {
-                'txhash': p.txhash,
-                'amount': p.amount,
-                'created_at': p.created_at.isoformat()
-            }
-            for p in payments
-        ]
-
-        # Check if user has passkeys to determine auth method
-        has_passkeys = db.session.query(PasskeyCredential).filter_by(user_id=user.user_id).first() is not None
-        auth_method = 'passkey' if has_passkeys else 'wallet'
-
         response_data = {
             'user_id': user.user_id,
             'username': user.username,  # Include username in response
             'api_key': user.api_key,
             'inbox_quota': user.inbox_quota,
-            'login_time': session.login_time,
-            'session_expires_at': session.expires_at.isoformat(),
-            'payments': payment_data,
-            'auth_method': auth_method
+            'purchased_quota': user.purchased_quota,
+            'login_time': principal.login_time,
+            'session_expires_at': principal.expires_at.isoformat() if principal.expires_at else None,
         }
 
         return jsonify(response_data), 200
@@ -605,12 +572,13 @@ def auth_me(token):
         return error_response('Failed to fetch user information', 500)
 
 @auth_bp.route('/logout', methods=['POST'])
-def auth_logout(token):
+def auth_logout():
     try:
-        session = db.session.query(UserSession).filter_by(token=token).first()
-        if session:
-            db.session.delete(session)
+        principal = current_principal()
+        if principal and principal.expires_at:
+            db.session.query(UserSession).filter_by(token=principal.token).delete()
             db.session.commit()
+            invalidate_token(principal.token)
 
         resp = make_response(jsonify({'success': True}))
         resp.set_cookie(
@@ -628,24 +596,14 @@ def auth_logout(token):
         db.session.rollback()
         return error_response('Logout failed', 500)
 
-# In-memory rate limit store: {ip: [timestamp, ...]}
-_register_attempts: dict = {}
 AGENT_STARTING_QUOTA = 1
-REGISTER_LIMIT = 3       # max registrations
-REGISTER_WINDOW = 86400  # per 24 hours
 
 @auth_bp.route('/register', methods=['POST'])
+@rate_limit('register', *REGISTER_RATE_LIMIT)
 def agent_register():
     """Programmatic registration for agents. Returns api_key directly."""
     try:
-        # Rate limit by IP
-        ip = request.headers.get('X-Forwarded-For', request.remote_addr).split(',')[0].strip()
-        now = time.time()
-        attempts = [t for t in _register_attempts.get(ip, []) if now - t < REGISTER_WINDOW]
-        if len(attempts) >= REGISTER_LIMIT:
-            return error_response('Rate limit exceeded. Max 3 registrations per IP per day.', 429)
-        _register_attempts[ip] = attempts + [now]
-
+        ip = client_ip()
         data = request.get_json() or {}
         username = data.get('username', '').strip()
 
@@ -1,54 +1,106 @@
 from functools import wraps
-from flask import request, abort
+from collections import OrderedDict, namedtuple
+from flask import request, abort, g
 from config import db, app
 from db_models import UserSession, User
 from datetime import datetime
+from sqlalchemy import select, null, union_all
+from constants import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+import threading
+import time
+
+# Identity resolved from a session token or API key. login_time and expires_at are None for API keys.
+Principal = namedtuple('Principal', 'token user_id api_key login_time expires_at')
+
+class TTLCache:
+    '''Bounded LRU mapping whose entries also expire after `ttl` seconds'''
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+# Per worker, so a logout on one worker is seen by the others within AUTH_CACHE_TTL
+principal_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+def get_request_token():
+    # Check both cookie and Authorization header
+    token = request.cookies.get("session_token")
+    if not token:
+        auth_header = request.headers.get("Authorization", "")
+        if auth_header.startswith("Bearer "):
+            token = auth_header[7:]
+        elif auth_header:
+            token = auth_header
+    return token
+
+def resolve_principal(token):
+    '''Returns the Principal for a session token or API key, or None if it is invalid'''
+    principal = principal_cache.get(token)
+    if principal is None:
+        # A live session with this token, or else the user whose API key it is, in one query
+        sessions = select(
+            UserSession.user_id, User.api_key, UserSession.login_time, UserSession.expires_at
+        ).join(
+            User, User.user_id == UserSession.user_id
+        ).where(
+            UserSession.token == token, UserSession.expires_at > datetime.utcnow()
+        )
+        api_keys = select(User.user_id, User.api_key, null(), null()).where(User.api_key == token)
+        row = db.session.execute(union_all(sessions, api_keys).limit(1)).first()
+        if not row:
+            return None
+        principal = Principal(token, *row)
+        principal_cache.set(token, principal)
+
+    if principal.expires_at and principal.expires_at <= datetime.utcnow():
+        principal_cache.discard(token)
+        return None
+    return principal
+
+def current_principal():
+    '''Identity of the current request, resolved at most once per request; None if unauthenticated'''
+    if 'principal' not in g:
+        token = get_request_token()
+        g.principal = resolve_principal(token) if token else None
+    return g.principal
+
+def invalidate_token(token):
+    principal_cache.discard(token)
 
 def auth_required(f):
+    '''Resolves the request's token once and passes the Principal to the view'''
     @wraps(f)
     def decorator(*args, **kwargs):
-        with app.app_context():
-            # Check both cookie and Authorization header
-            token = request.cookies.get("session_token")
-            if not token:
-                auth_header = request.headers.get("Authorization", "")
-                if auth_header.startswith("Bearer "):
-                    token = auth_header[7:]
-                elif auth_header:
-                    token = auth_header
-            
-            if not token:
-                app.logger.error("No token found")
-                abort(401)
-
-            session = None
-            
-            # First try to find it as a direct session token
-            session = db.session.query(UserSession).filter_by(token=token).first()
-            if session and session.expires_at > datetime.utcnow():
-                app.logger.info("Authenticated via session token")
-                return f(token, *args, **kwargs)
-            
-            # If not found as session token, try as API key directly
-            user = db.session.query(User).filter_by(api_key=token).first()
-            if user:
-                app.logger.info("Authenticated via API key")
-                return f(token, *args, **kwargs)
-            
+        principal = current_principal()
+        if not principal:
             app.logger.error("Invalid token/API key")
             abort(401)
-            
-    return decorator
 
-def get_api_key_from_token(token):
-    # If the token is itself an API key, return it directly
-    direct = db.session.query(User.api_key).filter_by(api_key=token).scalar()
-    if direct:
-        return direct
-    # Otherwise look it up via session
-    return (
-        db.session.query(User.api_key)
-        .join(UserSession, User.user_id == UserSession.user_id)
-        .filter(UserSession.token == token)
-        .scalar()
-    )
\ No newline at end of file
+        return f(principal, *args, **kwargs)
+
+    return decorator
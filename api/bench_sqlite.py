@@ -0,0 +1,108 @@
+#! /usr/bin/python3
+'''
+Read latency while mail is being ingested, per SQLite storage profile.
+
+Writer processes insert message rows one commit at a time, like POST /email, while
+reader processes run the GET /messages query; each profile gets a fresh scratch DB.
+
+    python3 bench_sqlite.py [--seconds 10] [--writers 2] [--readers 4] [legacy production]
+'''
+
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import string
+import tempfile
+import time
+from sqlite_profile import SQLITE_PROFILES, apply_pragmas
+
+INBOXES = [f'bench{i}@emptyinbox.me' for i in range(50)]
+BODY = 'x' * 2000
+
+def connect(path, profile):
+    conn = sqlite3.connect(path)
+    apply_pragmas(conn, profile)
+    return conn
+
+def setup(path, profile):
+    conn = connect(path, profile)
+    conn.execute('''CREATE TABLE messages (
+        id VARCHAR(16) PRIMARY KEY, inbox VARCHAR(120), timestamp INTEGER, subject TEXT, content TEXT)''')
+    conn.execute('CREATE INDEX ix_messages_inbox ON messages (inbox)')
+    rows = [(random_id(), random.choice(INBOXES), int(time.time()), 'seed', BODY) for _ in range(20000)]
+    conn.executemany('INSERT INTO messages VALUES (?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+def random_id():
+    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=16))
+
+def writer(path, profile, deadline, results):
+    conn = connect(path, profile)
+    written = errors = 0
+    while time.time() < deadline:
+        try:
+            conn.execute('INSERT INTO messages VALUES (?, ?, ?, ?, ?)',
+                         (random_id(), random.choice(INBOXES), int(time.time()), 'bench', BODY))
+            conn.commit()
+            written += 1
+        except sqlite3.OperationalError:
+            conn.rollback()
+            errors += 1
+    results.put(('writer', written, errors, []))
+
+def reader(path, profile, deadline, results):
+    conn = connect(path, profile)
+    latencies, errors = [], 0
+    while time.time() < deadline:
+        start = time.perf_counter()
+        try:
+            conn.execute('SELECT id, subject, timestamp FROM messages WHERE inbox IN (?, ?, ?) '
+                         'ORDER BY timestamp DESC LIMIT 100', random.sample(INBOXES, 3)).fetchall()
+            latencies.append(time.perf_counter() - start)
+        except sqlite3.OperationalError:
+            errors += 1
+    results.put(('reader', len(latencies), errors, latencies))
+
+def percentile(values, pct):
+    return sorted(values)[min(len(values) - 1, int(len(values) * pct / 100))] * 1000 if values else float('nan')
+
+def run(profile, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        setup(path, profile)
+        deadline = time.time() + args.seconds
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=writer, args=(path, profile, deadline, results))
+                 for _ in range(args.writers)]
+        procs += [multiprocessing.Process(target=reader, args=(path, profile, deadline, results))
+                  for _ in range(args.readers)]
+        for proc in procs:
+            proc.start()
+        collected = [results.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+
+    written = sum(count for kind, count, _, _ in collected if kind == 'writer')
+    write_errors = sum(errors for kind, _, errors, _ in collected if kind == 'writer')
+    read_errors = sum(errors for kind, _, errors, _ in collected if kind == 'reader')
+    latencies = [l for kind, _, _, lats in collected if kind == 'reader' for l in lats]
+    print(f'{profile:<12} writes/s {written / args.seconds:8.0f}  write errors {write_errors:5d}  '
+          f'reads/s {len(latencies) / args.seconds:8.0f}  read errors {read_errors:5d}  '
+          f'p50 {percentile(latencies, 50):7.2f} ms  p99 {percentile(latencies, 99):7.2f} ms  '
+          f'max {percentile(latencies, 100):8.2f} ms')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('profiles', nargs='*', default=['legacy', 'production'])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--readers', type=int, default=4)
+    args = parser.parse_args()
+    for profile in args.profiles:
+        if profile not in SQLITE_PROFILES:
+            parser.error(f'unknown profile {profile!r}, choose from {", ".join(SQLITE_PROFILES)}')
+    for profile in args.profiles:
+        run(profile, args)
@@ -0,0 +1,73 @@
+import hashlib
+import os
+import tempfile
+import time
+from config import instance_dir
+
+# Bodies at least this large (uncompressed) live on disk instead of in the messages table
+BLOB_THRESHOLD = int(os.getenv('BLOB_THRESHOLD', 64 << 10))
+# Shared storage (e.g. an NFS mount) when several API nodes use one database
+BLOB_DIR = os.getenv('BLOB_DIR', os.path.join(instance_dir, 'blobs'))
+# Blobs touched more recently than this are never collected, so a purge can't race an
+# ingest that is about to reference an existing blob
+BLOB_GC_GRACE = 3600
+
+def blob_path(digest):
+    return os.path.join(BLOB_DIR, digest[:2], digest[2:])
+
+def put_blob(data: bytes) -> str:
+    """Store data under its sha256 and return the digest. Identical bodies are stored once."""
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(digest)
+    if os.path.exists(path):
+        os.utime(path)
+        return digest
+    os.makedirs(os.path.dirname(path), mode=0o755, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return digest
+
+def read_blob(digest) -> bytes:
+    with open(blob_path(digest), 'rb') as f:
+        return f.read()
+
+def stale_files():
+    """Yields (digest, path) for each file in BLOB_DIR untouched within the grace period.
+    digest is None for temporary files left behind by an interrupted put_blob."""
+    cutoff = time.time() - BLOB_GC_GRACE
+    if not os.path.isdir(BLOB_DIR):
+        return
+    for prefix in os.scandir(BLOB_DIR):
+        if not prefix.is_dir():
+            continue
+        for entry in os.scandir(prefix.path):
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            digest = prefix.name + entry.name
+            yield (digest if len(digest) == 64 else None), entry.path
+
+def delete_blobs(digests):
+    """Remove the given blobs unless they were touched within the grace period.
+    Returns the number of blobs and bytes removed."""
+    removed = freed = 0
+    cutoff = time.time() - BLOB_GC_GRACE
+    for digest in digests:
+        path = blob_path(digest)
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime < cutoff:
+                os.remove(path)
+                removed += 1
+                freed += stat.st_size
+        except FileNotFoundError:
+            pass
+    return removed, freed
@@ -0,0 +1,39 @@
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The first byte of a stored message body says how it was encoded. Bodies written
+# before compression was introduced are raw JSON and always start with '{'.
+RAW = b'{'
+ZLIB = b'\x01'
+ZSTD = b'\x02'
+
+MESSAGE_CODEC = os.getenv('MESSAGE_CODEC', 'zstd' if zstandard else 'zlib')
+
+def compress(data: bytes) -> bytes:
+    """Compress a message body with the configured codec, prefixed by its version byte."""
+    if MESSAGE_CODEC == 'zstd' and zstandard:
+        return ZSTD + zstandard.ZstdCompressor(level=3).compress(data)
+    if MESSAGE_CODEC == 'none':
+        return data
+    return ZLIB + zlib.compress(data, 6)
+
+def decompress(blob: bytes) -> bytes:
+    """Return the original message body, whichever codec it was stored with."""
+    if not blob:
+        return blob
+    version, payload = blob[:1], blob[1:]
+    if version == ZLIB:
+        return zlib.decompress(payload)
+    if version == ZSTD:
+        if not zstandard:
+            raise RuntimeError("zstandard is required to read zstd-compressed messages")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return blob
+
+def is_compressed(blob: bytes) -> bool:
+    return bool(blob) and blob[:1] in (ZLIB, ZSTD)
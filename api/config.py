@@ -1,12 +1,17 @@
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_sqlalchemy import SQLAlchemy
-from flask_apscheduler import APScheduler
-from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlite_profile import apply_pragmas
 import logging
+import sqlite3
 import os
 
 app = Flask(__name__, instance_relative_config=True)
 app.debug = os.getenv('FLASK_ENV') == 'development'
+# nginx is the one proxy in front of the API; request.remote_addr is the address it saw
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 instance_dir = os.path.join(basedir, 'instance')
@@ -15,12 +20,36 @@ db_path = os.path.join(instance_dir, 'emptyinbox.db')
 # Ensure instance directory exists with proper permissions
 os.makedirs(instance_dir, mode=0o755, exist_ok=True)
 
-SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+# Any SQLAlchemy URL, e.g. postgresql+psycopg2://user:pass@db/emptyinbox to share one database
+# between several API nodes; defaults to the local SQLite file
+SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', f'sqlite:///{db_path}')
+if SQLALCHEMY_DATABASE_URI.startswith('postgres://'):
+    SQLALCHEMY_DATABASE_URI = 'postgresql://' + SQLALCHEMY_DATABASE_URI[len('postgres://'):]
+IS_SQLITE = SQLALCHEMY_DATABASE_URI.startswith('sqlite')
+
+SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True}
+if not IS_SQLITE:
+    # Per gunicorn worker: greenlets share this pool, so size it for the database's
+    # max_connections divided across workers and nodes, not for --worker-connections
+    SQLALCHEMY_ENGINE_OPTIONS.update(
+        pool_size=int(os.getenv('DB_POOL_SIZE', 10)),
+        max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', 10)),
+        pool_recycle=1800,
+    )
+
 app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = SQLALCHEMY_ENGINE_OPTIONS
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
 
+# PRAGMAs are per connection, so apply the storage profile to each one the pool opens
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        apply_pragmas(dbapi_connection)
+
 # --- Logging Configuration ---
 if not app.debug:
     handler = logging.StreamHandler()
@@ -29,31 +58,3 @@ if not app.debug:
     handler.setFormatter(formatter)
     app.logger.addHandler(handler)
     app.logger.setLevel(logging.INFO)
-
-# --- Cleanup job ---
-def delete_old_messages():
-    from db_models import Message
-    cutoff = int((datetime.utcnow() - timedelta(days=7)).timestamp())
-    deleted = db.session.query(Message).filter(Message.timestamp < cutoff).delete()
-    db.session.commit()
-    if deleted:
-        app.logger.info(f"Deleted {deleted} old messages")
-
-# --- APScheduler config ---
-class Config:
-    SCHEDULER_API_ENABLED = True
-
-app.config.from_object(Config)
-scheduler = APScheduler()
-scheduler.init_app(app)
-
-# Run every 24 hours
-scheduler.add_job(
-    id='Delete Old Messages',
-    func=delete_old_messages,
-    trigger='interval',
-    hours=24
-)
-
-scheduler.start()
-
@@ -3,3 +3,41 @@ USDT_DECIMALS = 1_000_000  # 6 decimal places
 QUOTA_PER_USDT = 10
 
 USER_STARTING_QUOTA = 5
+
+MESSAGES_PAGE_SIZE = 100
+MESSAGES_MAX_PAGE_SIZE = 500
+
+PAYMENTS_PAGE_SIZE = 20
+PAYMENTS_MAX_PAGE_SIZE = 100
+
+LONG_POLL_DEFAULT_TIMEOUT = 30   # seconds
+LONG_POLL_MAX_TIMEOUT = 50       # stay below nginx's default 60s proxy_read_timeout
+LONG_POLL_RECHECK_INTERVAL = 5   # catches mail ingested by other workers
+STREAM_HEARTBEAT_INTERVAL = 15   # keeps idle event streams alive through proxies
+
+AUTH_CACHE_SIZE = 10000
+AUTH_CACHE_TTL = 60              # seconds; bounds staleness across gunicorn workers
+
+MESSAGE_RETENTION_DAYS = 7       # unless the inbox or its owner sets retention_days
+RETENTION_INTERVAL_MINUTES = 5
+RETENTION_BATCH_SIZE = 500       # rows per delete; each batch holds the write lock briefly
+RETENTION_BATCH_PAUSE = 0.05     # seconds between batches so ingestion gets the lock
+RETENTION_MAX_RUNTIME = 60       # seconds; the next run picks up the rest
+BLOB_GC_INTERVAL_MINUTES = 360   # sweep of blob files no message references
+
+AUTH_CLEANUP_INTERVAL_MINUTES = 15
+JOB_JITTER = 30                  # seconds; spreads the workers' lease checks
+JOB_LEASE_GRACE = 60             # seconds past the interval before another process takes over a job
+
+TTL_BATCH_SIZE = 1000            # expired challenges and sessions deleted per statement
+TTL_BATCH_PAUSE = 0.05
+
+MAILBOX_NAME_MAX_TIER = 2        # 0 = adj.adj.noun only; 1 and 2 add 2 and 4 digits when names run short
+INBOX_INSERT_ATTEMPTS = 3        # retries when a concurrent request claims the same address
+MAX_INBOXES_PER_REQUEST = 500    # POST /inboxes count
+
+# (requests, per seconds) per client; see rate_limit.py
+REGISTER_RATE_LIMIT = (3, 86400)    # per IP
+PASSKEY_RATE_LIMIT = (30, 60)       # per IP
+INBOX_RATE_LIMIT = (60, 60)         # per API key
+EMAIL_RATE_LIMIT = (1200, 60)       # per sending host; the LMTP spool retries on 429
@@ -8,22 +8,49 @@ class PaymentStatus(Enum):
     PARTIALLY_CONFIRMED = "1"
     CONFIRMED = "2"
 
+class MonitorStatus(Enum):
+    QUEUED = "queued"            # waiting for payment_monitor.py to register it
+    REGISTERED = "registered"    # Blockonomics will call back on confirmation
+    FAILED = "failed"            # rejected, or retries exhausted; see monitor_error
+
 class Message(db.Model):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # Per-inbox listing and "newer than" lookups in seq order; also serves lookups by inbox alone
+        db.Index('ix_messages_inbox_seq', 'inbox', 'seq'),
+        # Listing and streaming all of a key's messages in seq order, a page at a time
+        db.Index('ix_messages_api_key_seq', 'api_key', 'seq'),
+    )
 
     id = db.Column(db.String(16), primary_key=True)
-    inbox = db.Column(db.String(250), index=True)
+    inbox = db.Column(db.String(250))
+    # Owner of the inbox at ingest; inboxes never change hands, so listings need no join
+    api_key = db.Column(db.String(250))
+    # Ingest order: taken from the 'messages' counter, whose row lock makes a larger seq
+    # commit after every smaller one (see store_emails)
+    seq = db.Column(db.BigInteger, nullable=False, default=0)
     subject  = db.Column(db.String(250))
-    timestamp = db.Column(db.BigInteger)
-    content = db.Column(db.BLOB(8 << 20))
+    timestamp = db.Column(db.BigInteger, index=True)  # retention purge range scan
+    # Precomputed at ingest so list endpoints never decode content
+    sender = db.Column(db.String(250))
+    snippet = db.Column(db.String(500))
+    size = db.Column(db.Integer)
+    has_html = db.Column(db.Boolean)
+    # sha256 of the body when it is too large to keep inline (see blob_store.py)
+    blob_hash = db.Column(db.String(64), index=True)
+    # Last: SQLite reads a row's columns in order, so everything above is read
+    # without walking the body's overflow pages (migration 15)
+    content = db.Column(db.LargeBinary)
 
 class Inbox(db.Model):
     __tablename__ = 'inboxes'
 
     api_key = db.Column(db.String(250), primary_key=True)
-    inbox = db.Column(db.String(250), primary_key=True)
+    # Unique across users; ingest also looks up by inbox alone
+    inbox = db.Column(db.String(250), primary_key=True, index=True, unique=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     connected_services = db.Column(JSON, default=list)
+    retention_days = db.Column(db.Integer)  # overrides the owner's; see retention.py
     
 class User(db.Model):
     __tablename__ = 'users'
@@ -32,7 +59,10 @@ class User(db.Model):
     username = db.Column(db.String(255), unique=True, nullable=False)  # New field
     api_key = db.Column(db.String(250), unique=True, nullable=False)
     inbox_quota = db.Column(db.Integer, default=0)
+    retention_days = db.Column(db.Integer)  # None means MESSAGE_RETENTION_DAYS
     created_at = db.Column(db.DateTime, default=datetime.utcnow)  # New field
+    # Bumped whenever the user's inboxes or messages change; the ETag of the list endpoints
+    list_version = db.Column(db.Integer, nullable=False, default=0)
 
 class PasskeyCredential(db.Model):
     __tablename__ = 'passkey_credentials'
@@ -56,7 +86,7 @@ class AuthChallenge(db.Model):
     nonce = db.Column(db.String(20), nullable=False)
     message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.Integer, nullable=False)
-    expires_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
 
     def __init__(self, address, nonce, message, timestamp):
         self.id = f"challenge:{address}:{nonce}"
@@ -68,6 +98,12 @@ class AuthChallenge(db.Model):
 
 class PasskeyChallenge(db.Model):
     __tablename__ = 'passkey_challenges'
+    __table_args__ = (
+        db.Index('idx_passkey_challenges_username', 'username'),
+        db.Index('idx_passkey_challenges_credential_id', 'credential_id'),
+        db.Index('idx_passkey_challenges_expires', 'expires_at'),
+        db.Index('idx_passkey_challenges_challenge', 'challenge'),
+    )
     
     challenge_id = db.Column(db.String(255), primary_key=True)  # Random challenge ID
     username = db.Column(db.String(255), nullable=True)         # Only for registration
@@ -90,9 +126,9 @@ class UserSession(db.Model):
     __tablename__ = 'user_sessions'
 
     token = db.Column(db.String, primary_key=True)
-    user_id = db.Column(db.String(255), db.ForeignKey('users.user_id'), nullable=False)
+    user_id = db.Column(db.String(255), db.ForeignKey('users.user_id'), nullable=False, index=True)
     login_time = db.Column(db.Integer, nullable=False)
-    expires_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
     
     # Relationship
     user = db.relationship('User', backref='sessions')
@@ -111,12 +147,52 @@ class PaymentIntent(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     amount = db.Column(db.Integer)
     status = db.Column(db.String(1), nullable=False, default="0")
+    # Registration with Blockonomics' transaction monitor, done by payment_monitor.py
+    monitor_status = db.Column(db.String(10), nullable=False, default=MonitorStatus.QUEUED.value)
+    monitor_attempts = db.Column(db.Integer, nullable=False, default=0)
+    monitor_next_attempt = db.Column(db.DateTime, default=datetime.utcnow)
+    monitor_error = db.Column(db.String(500))
+
+    __table_args__ = (
+        db.Index('ix_payment_intents_monitor', 'monitor_status', 'monitor_next_attempt'),
+        # Payment history in (created_at, txhash) order, and the purchased total in /auth/me
+        db.Index('ix_payment_intents_history', 'user_id', 'status', 'created_at', 'txhash'),
+    )
+
+
+class Counter(db.Model):
+    """A named sequence whose row lock serializes the transactions drawing from it."""
+    __tablename__ = 'counters'
+
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class ScheduledJob(db.Model):
+    """Leader lease and run metrics of one background job (see jobs.py)."""
+    __tablename__ = 'scheduled_jobs'
+
+    id = db.Column(db.String(100), primary_key=True)
+    holder = db.Column(db.String(255))                  # "hostname:pid" of the process running the job
+    lease_expires_at = db.Column(db.DateTime)
+    last_started_at = db.Column(db.DateTime)
+    last_duration_ms = db.Column(db.Integer)
+    last_error = db.Column(db.String(500))
+    runs = db.Column(db.Integer, nullable=False, default=0)
+    failures = db.Column(db.Integer, nullable=False, default=0)
 
 
 def main():
     from config import app, db
+    from sqlalchemy import inspect
+    from migration import stamp
     with app.app_context():
+        fresh = not inspect(db.engine).get_table_names()
         db.create_all()
+        # A new database already has the schema every migration builds; existing
+        # ones are brought up to date with `python migration.py`
+        if fresh:
+            stamp()
 
 if __name__=="__main__":
   main()
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""Background jobs, run by exactly one process.
+
+Every gunicorn worker starts the scheduler, so before each run a job claims its lease
+row in scheduled_jobs. The holder renews the lease on every run and other processes skip
+while it is valid; if the holder dies, the lease lapses after one interval plus
+JOB_LEASE_GRACE and the next process to try takes the job over. The lease lives in the
+database, so this also holds across API nodes sharing one database.
+
+Each run's start time, duration and outcome are recorded on the same row:
+
+    python jobs.py    # holder, last run, duration and failure count per job
+"""
+
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from flask_apscheduler import APScheduler
+from sqlalchemy import or_, text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from config import app, db, IS_SQLITE
+from db_models import ScheduledJob
+from sqlite_profile import SQLITE_PROFILE, SQLITE_PROFILES, WAL_CHECKPOINT_MINUTES
+from constants import (RETENTION_INTERVAL_MINUTES, AUTH_CLEANUP_INTERVAL_MINUTES, BLOB_GC_INTERVAL_MINUTES,
+                       JOB_JITTER, JOB_LEASE_GRACE)
+
+HOLDER = f'{socket.gethostname()}:{os.getpid()}'
+
+def delete_old_messages():
+    from retention import purge_messages
+    purge_messages()
+
+def collect_orphan_blobs():
+    from retention import collect_orphan_blobs
+    collect_orphan_blobs()
+
+def cleanup_auth_records():
+    from auth import cleanup_expired_auth_records
+    cleanup_expired_auth_records()
+
+def checkpoint_wal():
+    # wal_autocheckpoint can't finish while readers hold old snapshots; TRUNCATE resets the file
+    busy, log_pages, checkpointed = db.session.execute(text('PRAGMA wal_checkpoint(TRUNCATE)')).one()
+    db.session.commit()
+    if busy:
+        app.logger.info(f"WAL checkpoint incomplete: {checkpointed}/{log_pages} pages")
+
+# (id, function, interval in seconds)
+JOBS = [
+    # Short, bounded passes instead of one large daily DELETE
+    ('Delete Old Messages', delete_old_messages, RETENTION_INTERVAL_MINUTES * 60),
+    ('Cleanup Auth Records', cleanup_auth_records, AUTH_CLEANUP_INTERVAL_MINUTES * 60),
+    ('Collect Orphan Blobs', collect_orphan_blobs, BLOB_GC_INTERVAL_MINUTES * 60),
+]
+if IS_SQLITE and SQLITE_PROFILES[SQLITE_PROFILE].get('journal_mode', '').upper() == 'WAL':
+    JOBS.append(('Checkpoint WAL', checkpoint_wal, WAL_CHECKPOINT_MINUTES * 60))
+
+def claim_lease(job_id, interval):
+    '''Takes or renews the job's lease; False if another live process holds it'''
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=interval + JOB_LEASE_GRACE)
+    claimed = db.session.query(ScheduledJob).filter(
+        ScheduledJob.id == job_id,
+        or_(ScheduledJob.holder == HOLDER, ScheduledJob.lease_expires_at < now)
+    ).update({'holder': HOLDER, 'lease_expires_at': expires_at}, synchronize_session=False)
+    if not claimed:
+        if db.session.get(ScheduledJob, job_id) is not None:
+            db.session.rollback()
+            return False
+        db.session.add(ScheduledJob(id=job_id, holder=HOLDER, lease_expires_at=expires_at))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another process created the row first
+        db.session.rollback()
+        return False
+    return True
+
+def run_job(job_id, func, interval):
+    with app.app_context():
+        try:
+            if not claim_lease(job_id, interval):
+                return
+        except SQLAlchemyError:
+            db.session.rollback()
+            app.logger.exception(f"Job {job_id}: could not claim lease")
+            return
+
+        started_at = datetime.utcnow()
+        start = time.monotonic()
+        error = None
+        try:
+            func()
+        except Exception as e:
+            db.session.rollback()
+            error = repr(e)[:500]
+            app.logger.exception(f"Job {job_id} failed")
+        duration_ms = int((time.monotonic() - start) * 1000)
+
+        db.session.query(ScheduledJob).filter(ScheduledJob.id == job_id).update({
+            'last_started_at': started_at,
+            'last_duration_ms': duration_ms,
+            'last_error': error,
+            'runs': ScheduledJob.runs + 1,
+            'failures': ScheduledJob.failures + (1 if error else 0),
+        }, synchronize_session=False)
+        db.session.commit()
+        app.logger.info(f"Job {job_id} {'failed' if error else 'finished'} in {duration_ms} ms")
+
+# --- APScheduler config ---
+class Config:
+    SCHEDULER_API_ENABLED = True
+
+scheduler = APScheduler()
+
+def start():
+    app.config.from_object(Config)
+    scheduler.init_app(app)
+    for job_id, func, interval in JOBS:
+        scheduler.add_job(
+            id=job_id,
+            func=run_job,
+            args=(job_id, func, interval),
+            trigger='interval',
+            seconds=interval,
+            jitter=JOB_JITTER,
+            coalesce=True,
+            max_instances=1,
+        )
+    scheduler.start()
+
+if __name__ == '__main__':
+    with app.app_context():
+        for job in ScheduledJob.query.order_by(ScheduledJob.id):
+            print(f"{job.id:<22} holder={job.holder} lease_until={job.lease_expires_at} "
+                  f"last_run={job.last_started_at} duration_ms={job.last_duration_ms} "
+                  f"runs={job.runs} failures={job.failures}"
+                  + (f" last_error={job.last_error}" if job.last_error else ""))
@@ -0,0 +1,46 @@
+"""Conditional GETs for the list endpoints.
+
+Every user row carries list_version, a counter that each change to the user's inboxes
+or messages bumps in the same transaction: ingest, inbox creation and the retention
+purge. GET /messages and GET /inboxes send an ETag derived from it, and answer a
+matching If-None-Match with an empty 304 after one lookup on users, without reading
+the messages or inboxes tables. Idle polls cost a primary-key-sized query.
+"""
+
+import hashlib
+from functools import wraps
+from flask import request, make_response
+from config import db
+from db_models import User
+
+def bump(api_keys):
+    '''Marks the lists of these API keys as changed; the caller commits'''
+    api_keys = set(api_keys)
+    if api_keys:
+        db.session.query(User).filter(User.api_key.in_(api_keys)).update(
+            {'list_version': User.list_version + 1}, synchronize_session=False)
+
+def list_etag(api_key):
+    '''Returns the unquoted weak ETag of the current request's list'''
+    version = db.session.query(User.list_version).filter(User.api_key == api_key).scalar() or 0
+    # The same version gives a different body per path and query string
+    return hashlib.sha256(f'{api_key}:{version}:{request.full_path}'.encode()).hexdigest()[:32]
+
+def conditional(f):
+    '''Adds the ETag to a list view's response and turns matching If-None-Match into a 304
+
+    Goes below @auth_required. The version is read before the view runs, so a change
+    committed meanwhile only makes the next poll fetch the list again.
+    '''
+    @wraps(f)
+    def wrapper(principal, *args, **kwargs):
+        etag = list_etag(principal.api_key)
+        headers = {'ETag': f'W/"{etag}"', 'Cache-Control': 'private, no-cache'}
+        # Weak comparison, as RFC 9110 prescribes for If-None-Match
+        if request.if_none_match.contains_weak(etag):
+            return '', 304, headers
+        response = make_response(f(principal, *args, **kwargs))
+        if response.status_code == 200:
+            response.headers.update(headers)
+        return response
+    return wrapper
@@ -0,0 +1,87 @@
+'''
+Inbox address allocation.
+
+Names are drawn uniformly from the adj.adj.noun word space and checked against the
+unique index on inboxes.inbox, so no two users ever share an address. Each round draws
+at least MIN_DRAWS candidates, enough to estimate how full the tier is; when most of
+them collide, the allocator moves on to a longer tier (adj.adj.noun plus 2, then 4
+digits), which keeps the expected number of lookups constant however full the shorter
+names get.
+
+    python mailbox_names.py    # how full each tier is
+'''
+
+import re
+import secrets
+from config import app, db
+from db_models import Inbox
+from words import adjectives, nouns
+from constants import MAILBOX_NAME_MAX_TIER
+
+# Digits appended to the noun in each tier; tier 0 is the plain adj.adj.noun
+TIER_DIGITS = [0, 2, 4]
+BASE_SIZE = len(adjectives) ** 2 * len(nouns)
+# Move to the next tier once more than this share of a round's draws are taken
+ESCALATE_AT = 0.5
+# Draws per round however few names are needed, so one unlucky draw can't escalate
+MIN_DRAWS = 8
+MAX_ROUNDS = 20
+
+class NamespaceExhausted(Exception):
+    pass
+
+def tier_size(tier):
+    return BASE_SIZE * 10 ** TIER_DIGITS[tier]
+
+def draw_name(tier):
+    index = secrets.randbelow(tier_size(tier))
+    index, suffix = divmod(index, 10 ** TIER_DIGITS[tier])
+    index, noun = divmod(index, len(nouns))
+    first, second = divmod(index, len(adjectives))
+    name = f'{adjectives[first]}.{adjectives[second]}.{nouns[noun]}'
+    return f'{name}{suffix:0{TIER_DIGITS[tier]}d}' if TIER_DIGITS[tier] else name
+
+def allocate_addresses(count, domain):
+    '''Returns count distinct addresses that no inbox uses yet
+
+    The unique index still rejects an address another request inserts between this
+    check and the caller's commit; callers retry on IntegrityError.
+    '''
+    chosen = []
+    tier = 0
+    for _ in range(MAX_ROUNDS):
+        needed = count - len(chosen)
+        if not needed:
+            return chosen
+        draws = max(needed, MIN_DRAWS)
+        drawn = {f'{draw_name(tier)}@{domain}' for _ in range(draws)} - set(chosen)
+        taken = {row.inbox for row in db.session.query(Inbox.inbox).filter(Inbox.inbox.in_(drawn))}
+        fresh = [address for address in drawn if address not in taken]
+        chosen += fresh[:needed]
+        # Draws repeated within the round count as collisions too
+        collisions = draws - len(fresh)
+        if collisions > draws * ESCALATE_AT:
+            if tier >= MAILBOX_NAME_MAX_TIER:
+                break
+            tier += 1
+            app.logger.warning(f"Inbox names: {collisions}/{draws} draws taken, moving to tier {tier}")
+    if len(chosen) < count:
+        raise NamespaceExhausted(f"Could not find {count} free inbox names")
+    return chosen
+
+def namespace_usage():
+    '''Returns (tier, used, size) for each tier, counting existing inboxes by name shape'''
+    patterns = [re.compile(rf'[a-z]+\.[a-z]+\.[a-z]+[0-9]{{{digits}}}@') for digits in TIER_DIGITS]
+    used = [0] * len(TIER_DIGITS)
+    for (inbox,) in db.session.query(Inbox.inbox).yield_per(10000):
+        for tier, pattern in enumerate(patterns):
+            if pattern.match(inbox):
+                used[tier] += 1
+                break
+    return [(tier, used[tier], tier_size(tier)) for tier in range(len(TIER_DIGITS))]
+
+if __name__ == '__main__':
+    with app.app_context():
+        for tier, used, size in namespace_usage():
+            enabled = '' if tier <= MAILBOX_NAME_MAX_TIER else ' (disabled)'
+            print(f"tier {tier}: {used} of {size} names used ({used / size:.4%}){enabled}")
@@ -0,0 +1,26 @@
+import html
+import re
+
+SNIPPET_LENGTH = 500
+
+# Blocks whose contents are never shown, and comments (conditional comments included)
+_HIDDEN_RE = re.compile(r'<(style|script|head|title)\b[^>]*>.*?</\1\s*>|<!--.*?-->', re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r'<[^>]+>')
+_SPACE_RE = re.compile(r'\s+')
+
+def summarize_email(email_data, size):
+    '''Extracts the list-view columns (sender, snippet, size, has_html) from an email payload
+
+    Computed once at ingest so listing messages never has to decode the content blob.
+    '''
+    headers = email_data.get('headers') or {}
+    text_body = email_data.get('text_body') or ''
+    html_body = email_data.get('html_body') or ''
+    if not text_body and html_body:
+        text_body = html.unescape(_TAG_RE.sub(' ', _HIDDEN_RE.sub(' ', html_body)))
+    return dict(
+        sender=headers.get('From', email_data.get('sender', 'Unknown'))[:250],
+        snippet=_SPACE_RE.sub(' ', text_body).strip()[:SNIPPET_LENGTH],
+        size=size,
+        has_html=bool(html_body),
+    )
@@ -1,36 +1,379 @@
-import sqlite3
-
-DB_PATH = "instance/emptyinbox.db"
-
-def migrate_passkey_challenges():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    # Drop the old table if it exists
-    cur.execute("DROP TABLE IF EXISTS passkey_challenges;")
-
-    # Create the new table with updated schema
-    cur.execute("""
-        CREATE TABLE passkey_challenges (
-            challenge_id   VARCHAR(255) NOT NULL,
-            username       VARCHAR(255),              -- only for registration
-            credential_id  VARCHAR(1000),             -- only for authentication
-            challenge      VARCHAR(1000) NOT NULL,    -- Base64url encoded challenge
-            operation_type VARCHAR(20) NOT NULL,      -- "registration" or "authentication"
-            created_at     DATETIME DEFAULT CURRENT_TIMESTAMP,
-            expires_at     DATETIME NOT NULL,
-            PRIMARY KEY (challenge_id)
-        );
-    """)
-
-    # Create indexes for both lookup paths
-    cur.execute("CREATE INDEX idx_passkey_challenges_username ON passkey_challenges(username);")
-    cur.execute("CREATE INDEX idx_passkey_challenges_credential_id ON passkey_challenges(credential_id);")
-    cur.execute("CREATE INDEX idx_passkey_challenges_expires ON passkey_challenges(expires_at);")
-
-    conn.commit()
-    conn.close()
-    print("Migration completed: passkey_challenges table updated.")
+"""Versioned schema migrations.
+
+Each migration runs once, in order, and is recorded in the schema_migrations table.
+Migrations only add to the schema and check what already exists, so one interrupted
+half-way is simply run again.
+
+    python migration.py            # apply pending migrations
+    python migration.py status     # list applied and pending migrations
+    python migration.py explain    # query plans of the hot paths (SQLite), see tests/test_query_plans.py
+
+`pipenv run create_db` builds a new database at the latest version directly.
+"""
+
+import json
+import sys
+import zlib
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from config import app, db
+from message_summary import summarize_email
+from codec import compress, decompress, is_compressed
+
+def column_names(conn, table):
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+def add_columns(conn, table, columns):
+    existing = column_names(conn, table)
+    for column, ddl in columns:
+        if column not in existing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+def migrate_passkey_challenges(engine):
+    """Recreates passkey_challenges for both registration and authentication challenges."""
+    from db_models import PasskeyChallenge
+    with engine.begin() as conn:
+        # Challenges live for five minutes, so the old table is dropped rather than copied
+        if not inspect(conn).has_table("passkey_challenges"):
+            PasskeyChallenge.__table__.create(conn)
+        elif "operation_type" not in column_names(conn, "passkey_challenges"):
+            conn.execute(text("DROP TABLE passkey_challenges"))
+            PasskeyChallenge.__table__.create(conn)
+        # Create indexes for both lookup paths
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_passkey_challenges_username ON passkey_challenges(username)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_passkey_challenges_credential_id ON passkey_challenges(credential_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_passkey_challenges_expires ON passkey_challenges(expires_at)"))
+
+def migrate_message_summaries(engine, batch_size=500):
+    """Adds the precomputed summary columns to messages and backfills existing rows."""
+    with engine.begin() as conn:
+        add_columns(conn, "messages", (
+            ("sender", "VARCHAR(250)"),
+            ("snippet", "VARCHAR(500)"),
+            ("size", "INTEGER"),
+            ("has_html", "BOOLEAN"),
+        ))
+
+    backfilled = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text("SELECT id, content FROM messages WHERE size IS NULL LIMIT :limit"),
+                {"limit": batch_size},
+            ).fetchall()
+            if not rows:
+                break
+            updates = []
+            for msg_id, content in rows:
+                content = content or b""
+                try:
+                    content = decompress(content)
+                    email_data = json.loads(content.decode("utf-8")) if content else {}
+                except (json.JSONDecodeError, UnicodeDecodeError, zlib.error):
+                    email_data = {}
+                updates.append(dict(summarize_email(email_data, len(content)), id=msg_id))
+            conn.execute(
+                text("UPDATE messages SET sender = :sender, snippet = :snippet, size = :size, "
+                     "has_html = :has_html WHERE id = :id"),
+                updates,
+            )
+        backfilled += len(rows)
+    print(f"  backfilled summaries for {backfilled} messages")
+
+def migrate_compress_messages(engine, batch_size=500):
+    """Recompresses legacy raw-JSON message bodies and vacuums the database."""
+    compressed = saved = 0
+    last_id = ""
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text("SELECT id, content FROM messages WHERE id > :last_id ORDER BY id LIMIT :limit"),
+                {"last_id": last_id, "limit": batch_size},
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = []
+            for msg_id, content in rows:
+                if not content or is_compressed(content):
+                    continue
+                packed = compress(content)
+                updates.append({"content": packed, "id": msg_id})
+                saved += len(content) - len(packed)
+            if updates:
+                conn.execute(text("UPDATE messages SET content = :content WHERE id = :id"), updates)
+        compressed += len(updates)
+
+    # Hand the freed pages back to the filesystem; VACUUM can't run inside a transaction
+    if engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+    print(f"  compressed {compressed} messages, saved {saved} bytes")
+
+def migrate_blob_hash(engine):
+    """Adds the blob_hash column used for bodies offloaded to the blob store."""
+    with engine.begin() as conn:
+        add_columns(conn, "messages", (("blob_hash", "VARCHAR(64)"),))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_blob_hash ON messages(blob_hash)"))
+
+def migrate_query_indexes(engine):
+    """Indexes for message listing, the retention purge, ingest and per-user lookups."""
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_inbox_timestamp ON messages(inbox, timestamp, id)"))
+        # Superseded by the composite index, which starts with inbox
+        conn.execute(text("DROP INDEX IF EXISTS ix_messages_inbox"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_timestamp ON messages(timestamp)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_inboxes_inbox ON inboxes(inbox)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_user_sessions_user_id ON user_sessions(user_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_payment_intents_user_id ON payment_intents(user_id)"))
+
+def migrate_retention(engine):
+    """Adds per-inbox and per-user retention and enables incremental vacuum on SQLite."""
+    with engine.begin() as conn:
+        add_columns(conn, "inboxes", (("retention_days", "INTEGER"),))
+        add_columns(conn, "users", (("retention_days", "INTEGER"),))
+
+    if engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            # 2 = INCREMENTAL; switching an existing database takes a full VACUUM, once
+            if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+                conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+                conn.execute(text("VACUUM"))
+
+def migrate_scheduled_jobs(engine):
+    """Adds the table holding background job leases and run metrics."""
+    from db_models import ScheduledJob
+    with engine.begin() as conn:
+        ScheduledJob.__table__.create(conn, checkfirst=True)
+
+def migrate_expiry_indexes(engine):
+    """Indexes the expiry purge and the passkey challenge lookup."""
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_auth_challenges_expires_at ON auth_challenges(expires_at)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_user_sessions_expires_at ON user_sessions(expires_at)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_passkey_challenges_challenge ON passkey_challenges(challenge)"))
+
+def migrate_unique_inbox(engine):
+    """Makes inbox addresses unique across users."""
+    with engine.begin() as conn:
+        shared = conn.execute(text(
+            "SELECT inbox, COUNT(*) FROM inboxes GROUP BY inbox HAVING COUNT(*) > 1"
+        )).fetchall()
+        if shared:
+            for inbox, owners in shared:
+                print(f"  {inbox} belongs to {owners} API keys")
+            raise SystemExit("Give each of these addresses a single owner, then run the migration again")
+        conn.execute(text("DROP INDEX IF EXISTS ix_inboxes_inbox"))
+        conn.execute(text("CREATE UNIQUE INDEX ix_inboxes_inbox ON inboxes(inbox)"))
+
+def migrate_payment_monitor(engine):
+    """Adds the background monitor registration state to payment intents."""
+    with engine.begin() as conn:
+        # Intents from before this were registered in the request that created them
+        add_columns(conn, "payment_intents", (
+            ("monitor_status", "VARCHAR(10) NOT NULL DEFAULT 'registered'"),
+            ("monitor_attempts", "INTEGER NOT NULL DEFAULT 0"),
+            ("monitor_next_attempt", "TIMESTAMP"),
+            ("monitor_error", "VARCHAR(500)"),
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_payment_intents_monitor "
+                          "ON payment_intents(monitor_status, monitor_next_attempt)"))
+
+def migrate_payment_history(engine):
+    """Indexes a user's payments by status and date for GET /payments/history."""
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_payment_intents_user_status_created "
+                          "ON payment_intents(user_id, status, created_at)"))
+        # Superseded by the composite index, which starts with user_id
+        conn.execute(text("DROP INDEX IF EXISTS ix_payment_intents_user_id"))
+
+def migrate_list_version(engine):
+    """Adds the per-user change counter behind the list endpoints' ETags."""
+    with engine.begin() as conn:
+        add_columns(conn, "users", (("list_version", "INTEGER NOT NULL DEFAULT 0"),))
+
+def migrate_message_seq(engine):
+    """Numbers messages in ingest order for the wait and stream endpoints."""
+    from db_models import Counter
+    with engine.begin() as conn:
+        add_columns(conn, "messages", (("seq", "BIGINT NOT NULL DEFAULT 0"),))
+        Counter.__table__.create(conn, checkfirst=True)
+        if not conn.execute(text("SELECT 1 FROM counters WHERE name = 'messages'")).first():
+            # Existing messages are numbered in (timestamp, id) order, the order they were listed in
+            conn.execute(text(
+                "CREATE TEMPORARY TABLE message_seq AS "
+                "SELECT id, ROW_NUMBER() OVER (ORDER BY timestamp, id) AS seq FROM messages"
+            ))
+            conn.execute(text("CREATE UNIQUE INDEX message_seq_id ON message_seq(id)"))
+            conn.execute(text(
+                "UPDATE messages SET seq = (SELECT seq FROM message_seq WHERE message_seq.id = messages.id)"
+            ))
+            conn.execute(text("DROP TABLE message_seq"))
+            conn.execute(text(
+                "INSERT INTO counters (name, value) SELECT 'messages', COALESCE(MAX(seq), 0) FROM messages"
+            ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_inbox_seq ON messages(inbox, seq)"))
+        # Listing now orders by seq too
+        conn.execute(text("DROP INDEX IF EXISTS ix_messages_inbox_timestamp"))
+
+def migrate_message_api_key(engine):
+    """Copies each message's owner onto it, so a key's messages are listed in seq order by index."""
+    with engine.begin() as conn:
+        add_columns(conn, "messages", (("api_key", "VARCHAR(250)"),))
+        conn.execute(text(
+            "UPDATE messages SET api_key = (SELECT api_key FROM inboxes WHERE inboxes.inbox = messages.inbox) "
+            "WHERE api_key IS NULL"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_api_key_seq ON messages(api_key, seq)"))
+
+def migrate_message_layout(engine):
+    """Rebuilds messages with content as the last column, so summaries don't read the body.
+
+    SQLite stores a row's columns in table order and spills a large value onto overflow
+    pages; columns added after content (sender, snippet, size, has_html, seq, api_key) sit
+    behind that chain. PostgreSQL keeps large values out of line already. The copy runs
+    in one transaction and needs room for a second copy of the table meanwhile.
+    """
+    from sqlalchemy.schema import CreateTable
+    from db_models import Message
+    if engine.dialect.name != "sqlite":
+        return
+    table = Message.__table__
+    with engine.begin() as conn:
+        existing = [row[1] for row in conn.execute(text("PRAGMA table_info(messages)"))]
+        if existing == [column.name for column in table.columns]:
+            return
+        for index in inspect(conn).get_indexes("messages"):
+            conn.execute(text(f"DROP INDEX {index['name']}"))
+        conn.execute(text("ALTER TABLE messages RENAME TO messages_old"))
+        conn.execute(CreateTable(table))
+        columns = ", ".join(column.name for column in table.columns)
+        conn.execute(text(f"INSERT INTO messages ({columns}) SELECT {columns} FROM messages_old"))
+        conn.execute(text("DROP TABLE messages_old"))
+        for index in table.indexes:
+            index.create(conn)
+
+def migrate_payment_history_order(engine):
+    """Extends the payment history index with txhash, the tiebreak of its ORDER BY."""
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_payment_intents_history "
+                          "ON payment_intents(user_id, status, created_at, txhash)"))
+        conn.execute(text("DROP INDEX IF EXISTS ix_payment_intents_user_status_created"))
+
+# (version, name, migration) in the order they are applied. Never renumber or remove
+# an entry once it has shipped; add a new one instead.
+MIGRATIONS = [
+    (1, "passkey_challenges", migrate_passkey_challenges),
+    (2, "message_summaries", migrate_message_summaries),
+    (3, "compress_messages", migrate_compress_messages),
+    (4, "blob_hash", migrate_blob_hash),
+    (5, "query_indexes", migrate_query_indexes),
+    (6, "retention", migrate_retention),
+    (7, "scheduled_jobs", migrate_scheduled_jobs),
+    (8, "expiry_indexes", migrate_expiry_indexes),
+    (9, "unique_inbox", migrate_unique_inbox),
+    (10, "payment_monitor", migrate_payment_monitor),
+    (11, "payment_history", migrate_payment_history),
+    (12, "list_version", migrate_list_version),
+    (13, "message_seq", migrate_message_seq),
+    (14, "message_api_key", migrate_message_api_key),
+    (15, "message_layout", migrate_message_layout),
+    (16, "payment_history_order", migrate_payment_history_order),
+]
+
+def ensure_version_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version    INTEGER PRIMARY KEY,
+                name       VARCHAR(100) NOT NULL,
+                applied_at TIMESTAMP NOT NULL
+            )
+        """))
+
+def applied_versions(engine):
+    ensure_version_table(engine)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+def record(engine, version, name):
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+            {"version": version, "name": name, "applied_at": datetime.utcnow()},
+        )
+
+def upgrade(engine=None):
+    engine = engine or db.engine
+    applied = applied_versions(engine)
+    pending = [m for m in MIGRATIONS if m[0] not in applied]
+    for version, name, migrate in pending:
+        print(f"Applying {version:03d} {name}")
+        migrate(engine)
+        record(engine, version, name)
+    print(f"Database is at version {MIGRATIONS[-1][0]}" if pending else "Database is up to date")
+
+def stamp():
+    """Marks every migration applied, for a database created from the current models."""
+    engine = db.engine
+    applied = applied_versions(engine)
+    for version, name, _ in MIGRATIONS:
+        if version not in applied:
+            record(engine, version, name)
+
+def status():
+    applied = applied_versions(db.engine)
+    for version, name, _ in MIGRATIONS:
+        print(f"{version:03d} {name:<24} {'applied' if version in applied else 'pending'}")
+
+# The queries behind GET /messages, ingest, the retention purge, /auth/me and payment history
+EXPLAIN_QUERIES = {
+    "list messages of an inbox":
+        "SELECT id FROM messages WHERE inbox = 'a@b' ORDER BY seq DESC LIMIT 100",
+    "list messages of an api key":
+        "SELECT id FROM messages WHERE api_key = 'k' ORDER BY seq DESC LIMIT 100",
+    "stream messages of an api key":
+        "SELECT id FROM messages WHERE api_key = 'k' AND seq > 0 ORDER BY seq ASC LIMIT 100",
+    "ingest recipient lookup": "SELECT inbox, api_key FROM inboxes WHERE inbox IN ('a@b', 'c@d')",
+    "retention purge": "SELECT id FROM messages WHERE timestamp < 0",
+    "sessions of a user": "SELECT token FROM user_sessions WHERE user_id = 'u'",
+    "payment history":
+        "SELECT txhash, amount, created_at FROM payment_intents WHERE user_id = 'u' AND status = '2' "
+        "ORDER BY created_at DESC, txhash DESC LIMIT 21",
+    "purchased quota of a user":
+        "SELECT SUM(amount) FROM payment_intents WHERE user_id = 'u' AND status = '2'",
+    "expired sessions": "SELECT token FROM user_sessions WHERE expires_at < '2000-01-01' LIMIT 1000",
+    "expired auth challenges": "SELECT id FROM auth_challenges WHERE expires_at < '2000-01-01' LIMIT 1000",
+    "wait for new messages":
+        "SELECT id FROM messages WHERE inbox = 'a@b' AND seq > 0 ORDER BY seq DESC LIMIT 100",
+    "passkey challenge lookup":
+        "SELECT challenge_id FROM passkey_challenges WHERE challenge = 'c' AND operation_type = 'authentication' "
+        "AND username IS NULL AND expires_at > '2000-01-01'",
+}
+
+def query_plan(conn, sql):
+    """The steps of a query's SQLite plan, and those that scan a table or sort its rows."""
+    plan = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+    return plan, [step for step in plan if step.startswith("SCAN") or "TEMP B-TREE" in step]
+
+def explain():
+    """Prints each hot query's plan; exits non-zero if any scans a whole table or sorts."""
+    slow = 0
+    with db.engine.connect() as conn:
+        for label, sql in EXPLAIN_QUERIES.items():
+            plan, problems = query_plan(conn, sql)
+            slow += bool(problems)
+            print(f"{'SLOW' if problems else 'ok':<5} {label}: {'; '.join(plan)}")
+    sys.exit(1 if slow else 0)
+
+COMMANDS = {
+    "upgrade": upgrade,
+    "status": status,
+    "explain": explain,
+}
 
 if __name__ == "__main__":
-    migrate_passkey_challenges()
\ No newline at end of file
+    with app.app_context():
+        COMMANDS[sys.argv[1] if len(sys.argv) > 1 else "upgrade"]()
@@ -0,0 +1,38 @@
+import threading
+from collections import defaultdict
+
+class Notifier:
+    '''In-process fan-out of "something changed" signals, keyed by an arbitrary string.
+
+    Waiters subscribe an Event for a key and block on it; notify() sets every Event
+    registered for that key. Only requests served by the same worker process are
+    woken, so waiters should still re-check the database on a slow interval.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = defaultdict(set)
+
+    def subscribe(self, key):
+        event = threading.Event()
+        with self._lock:
+            self._waiters[key].add(event)
+        return event
+
+    def unsubscribe(self, key, event):
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if waiters is None:
+                return
+            waiters.discard(event)
+            if not waiters:
+                del self._waiters[key]
+
+    def notify(self, key):
+        with self._lock:
+            waiters = list(self._waiters.get(key, ()))
+        for event in waiters:
+            event.set()
+
+inbox_notifier = Notifier()
+api_key_notifier = Notifier()
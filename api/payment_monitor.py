@@ -0,0 +1,102 @@
+"""Registers payment intents with Blockonomics' transaction monitor in the background.
+
+POST /payments/monitor only records the intent as queued; a daemon thread in each worker
+claims queued intents and calls monitor_tx over one pooled keep-alive session with
+timeouts. Failures are retried with exponential back-off, and a rejection by
+Blockonomics (4xx) is recorded on the intent. Claims are conditional UPDATEs, so an
+intent is sent by one worker at a time however many are running.
+"""
+
+import os
+import threading
+from datetime import datetime, timedelta
+import requests
+from requests.adapters import HTTPAdapter
+from config import app, db
+from db_models import PaymentIntent, MonitorStatus
+
+BLOCKONOMICS_URL = os.getenv('BLOCKONOMICS_URL', 'https://www.blockonomics.co')
+TIMEOUT = (3.05, 10)        # connect, read
+POLL_INTERVAL = 5           # seconds; also picks up retries and intents queued by other workers
+CLAIM_SECONDS = 60          # a claimed intent is retried after this if its worker dies
+MAX_BACKOFF = 600
+MAX_ATTEMPTS = 12
+BATCH_SIZE = 20
+
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+session.headers.update({'Content-Type': 'application/json'})
+
+wakeup = threading.Event()
+
+def register(txhash):
+    '''Asks Blockonomics to call MATCH_CALLBACK when txhash confirms; raises on failure'''
+    response = session.post(
+        f'{BLOCKONOMICS_URL}/api/monitor_tx',
+        headers={'Authorization': f"Bearer {os.getenv('BLOCKONOMICS_API_KEY')}"},
+        json={
+            'txhash': txhash,
+            'crypto': 'USDT',
+            'match_callback': os.getenv('MATCH_CALLBACK'),
+            'testnet': 1,
+        },
+        timeout=TIMEOUT,
+    )
+    response.raise_for_status()
+
+def claim(txhash, now):
+    claimed = db.session.query(PaymentIntent).filter(
+        PaymentIntent.txhash == txhash,
+        PaymentIntent.monitor_status == MonitorStatus.QUEUED.value,
+        PaymentIntent.monitor_next_attempt <= now,
+    ).update({'monitor_next_attempt': now + timedelta(seconds=CLAIM_SECONDS)}, synchronize_session=False)
+    db.session.commit()
+    return bool(claimed)
+
+def process_due():
+    '''Registers every queued intent that is due. Returns how many were attempted.'''
+    now = datetime.utcnow()
+    due = [row.txhash for row in db.session.query(PaymentIntent.txhash).filter(
+        PaymentIntent.monitor_status == MonitorStatus.QUEUED.value,
+        PaymentIntent.monitor_next_attempt <= now,
+    ).limit(BATCH_SIZE)]
+    db.session.commit()
+
+    for txhash in due:
+        if not claim(txhash, now):
+            continue
+        update = {'monitor_attempts': PaymentIntent.monitor_attempts + 1}
+        try:
+            register(txhash)
+            update.update(monitor_status=MonitorStatus.REGISTERED.value, monitor_error=None)
+        except requests.RequestException as e:
+            attempts = db.session.query(PaymentIntent.monitor_attempts).filter_by(txhash=txhash).scalar()
+            rejected = e.response is not None and 400 <= e.response.status_code < 500
+            error = (f'HTTP {e.response.status_code}: {e.response.text}' if e.response is not None
+                     else repr(e))[:500]
+            if rejected or attempts + 1 >= MAX_ATTEMPTS:
+                app.logger.error(f"Monitoring {txhash} failed: {error}")
+                update.update(monitor_status=MonitorStatus.FAILED.value, monitor_error=error)
+            else:
+                app.logger.warning(f"Monitoring {txhash} failed, retrying: {error}")
+                update.update(monitor_error=error, monitor_next_attempt=datetime.utcnow() + timedelta(
+                    seconds=min(MAX_BACKOFF, 2 ** (attempts + 1))))
+        db.session.query(PaymentIntent).filter_by(txhash=txhash).update(update, synchronize_session=False)
+        db.session.commit()
+    return len(due)
+
+def run():
+    while True:
+        wakeup.wait(POLL_INTERVAL)
+        wakeup.clear()
+        with app.app_context():
+            try:
+                while process_due() == BATCH_SIZE:
+                    pass
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Payment monitor failed")
+
+def start():
+    threading.Thread(target=run, name='payment-monitor', daemon=True).start()
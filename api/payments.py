@@ -1,40 +1,19 @@
 from flask import Blueprint, request, jsonify
 from datetime import datetime
-import requests
-import os
+import os, base64
+from sqlalchemy import func, select, or_, and_
+from sqlalchemy.exc import IntegrityError
 from config import db
 
-from constants import USDT_DECIMALS, QUOTA_PER_USDT
-from db_models import User, UserSession, PaymentIntent, PaymentStatus
+from constants import USDT_DECIMALS, QUOTA_PER_USDT, PAYMENTS_PAGE_SIZE, PAYMENTS_MAX_PAGE_SIZE
+from db_models import User, PaymentIntent, PaymentStatus
+from auth_utils import current_principal
+import payment_monitor
 
 payments_bp = Blueprint('payments', __name__)
 
 USDT_ADDRESS = os.getenv('USDT_RECEIVING_ADDRESS', '0x742d35Cc6634C0532925a3b8D9DDdB4D1f0B1b69')
 
-def get_current_user():
-    """Get current user from API key (not session token)"""
-    try:
-        auth_header = request.headers.get('Authorization')
-        if not auth_header:
-            return None
-
-        if auth_header.startswith('Bearer '):
-            api_key = auth_header[7:]
-        else:
-            api_key = auth_header
-
-        if not api_key:
-            return None
-
-        user = db.session.query(User).filter_by(api_key=api_key).first()
-        if not user:
-            return None
-
-        return user.user_id
-
-    except Exception:
-        return None
-
 def error_response(message: str, code: int = 400):
     return jsonify({'error': message}), code
 
@@ -45,10 +24,60 @@ def get_payment_config():
         'quota_per_usdt': 10,
     })
 
+def encode_cursor(created_at, txhash):
+    raw = f'{created_at.isoformat()}|{txhash}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    created_at, txhash = base64.urlsafe_b64decode(padded).decode().split('|', 1)
+    return datetime.fromisoformat(created_at), txhash
+
+@payments_bp.route('/history', methods=['GET'])
+def payment_history():
+    """Returns a page of the caller's confirmed payments, newest first.
+
+    Query params: limit, cursor (from the X-Next-Cursor header of the previous page).
+    Served by ix_payment_intents_history, so a page costs the same however
+    many payments the user has.
+    """
+    principal = current_principal()
+    if not principal:
+        return error_response("Unauthorized", 401)
+
+    limit = request.args.get('limit', PAYMENTS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, PAYMENTS_MAX_PAGE_SIZE))
+    cursor = request.args.get('cursor')
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return error_response("Invalid cursor", 400)
+
+    query = db.session.query(PaymentIntent.txhash, PaymentIntent.amount, PaymentIntent.created_at).filter(
+        PaymentIntent.user_id == principal.user_id,
+        PaymentIntent.status == PaymentStatus.CONFIRMED.value,
+    )
+    if after:
+        created_at, txhash = after
+        query = query.filter(or_(
+            PaymentIntent.created_at < created_at,
+            and_(PaymentIntent.created_at == created_at, PaymentIntent.txhash < txhash),
+        ))
+    rows = query.order_by(PaymentIntent.created_at.desc(), PaymentIntent.txhash.desc()).limit(limit + 1).all()
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(rows[-1].created_at, rows[-1].txhash)
+    return jsonify([
+        {'txhash': row.txhash, 'amount': row.amount, 'created_at': row.created_at.isoformat()}
+        for row in rows
+    ]), 200, headers
+
 @payments_bp.route('/monitor', methods=['POST'])
 def monitor_transaction():
-    current_user_id = get_current_user()
-    if not current_user_id:
+    principal = current_principal()
+    if not principal:
         return error_response("Unauthorized", 401)
 
     data = request.get_json()
@@ -60,65 +89,91 @@ def monitor_transaction():
     if not txhash:
         return error_response("Missing txhash", 400)
 
-    match_callback = os.getenv('MATCH_CALLBACK')
-
+    # Registering with Blockonomics happens in the background (payment_monitor.py)
     try:
-        response = requests.post(
-            "https://www.blockonomics.co/api/monitor_tx",
-            headers={
-                "Authorization": f"Bearer {os.getenv('BLOCKONOMICS_API_KEY')}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "txhash": txhash,
-                "crypto": "USDT",
-                "match_callback": match_callback,
-                "testnet": 1,
-            }
-        )
-
-        if response.status_code == 200:
-            payment_intent = PaymentIntent(txhash=txhash, user_id=current_user_id, amount=inbox_quota)
-            db.session.add(payment_intent)
-            db.session.commit()
-            return jsonify({"message": "Monitoring started"})
-        else:
-            return error_response(f"Blockonomics error: {response.text}", response.status_code)
-
-    except Exception:
+        payment_intent = PaymentIntent(txhash=txhash, user_id=principal.user_id, amount=inbox_quota)
+        db.session.add(payment_intent)
+        db.session.commit()
+    except IntegrityError:
         db.session.rollback()
-        return error_response("Internal server error", 500)
-
-@payments_bp.route('/callback', methods=['GET'])
-def blockonomics_callback():
-    txid = request.args.get('txid')
-    value = request.args.get('value')
-    addr  = request.args.get('addr')
-    status = request.args.get('status')
-
+        return error_response("Transaction already submitted", 409)
+    payment_monitor.wakeup.set()
+    return jsonify({"message": "Monitoring queued", "status": "pending"}), 202
+
+def confirm_payment(txid):
+    """Flips a pending intent to confirmed and credits its quota, exactly once; the caller commits.
+
+    The flip is conditional on the intent not being confirmed yet, and the credit only runs
+    when it matched, so duplicate or concurrent callbacks for one txid credit it once.
+    """
+    flipped = db.session.query(PaymentIntent).filter(
+        PaymentIntent.txhash == txid,
+        PaymentIntent.status != PaymentStatus.CONFIRMED.value,
+        PaymentIntent.user_id.in_(select(User.user_id)),
+    ).update({'status': PaymentStatus.CONFIRMED.value}, synchronize_session=False)
+    if not flipped:
+        intent = db.session.query(PaymentIntent.status).filter_by(txhash=txid).first()
+        if not intent:
+            return "Payment intent not found", 404
+        if intent.status == PaymentStatus.CONFIRMED.value:
+            return "Payment already confirmed", 200
+        return "User not found", 404
+
+    intent = select(PaymentIntent).where(PaymentIntent.txhash == txid).subquery()
+    db.session.query(User).filter(
+        User.user_id == select(intent.c.user_id).scalar_subquery()
+    ).update({
+        'inbox_quota': User.inbox_quota + select(func.coalesce(intent.c.amount, 0)).scalar_subquery()
+    }, synchronize_session=False)
+    return "Callback processed", 200
+
+def process_callback(txid, value, addr, status):
+    """Validates one Blockonomics callback and confirms its payment. Returns (message, code)."""
     if not txid or not value or not addr or not status:
-        return error_response("Missing required fields", 400)
+        return "Missing required fields", 400
 
-    if status != PaymentStatus.CONFIRMED.value:
-        return jsonify({"message": "The payment is not confirmed"}), 200
+    if str(status) != PaymentStatus.CONFIRMED.value:
+        return "The payment is not confirmed", 200
 
     if addr.lower() != USDT_ADDRESS.lower():
-        return error_response("Address mismatch", 400)
-
-    intent = db.session.query(PaymentIntent).filter_by(txhash=txid).first()
-    if not intent:
-        return error_response("Payment intent not found", 404)
+        return "Address mismatch", 400
 
-    if intent.status == PaymentStatus.CONFIRMED.value:
-        return jsonify({"message": "Payment already confirmed"}), 200
+    return confirm_payment(txid)
 
-    user = db.session.query(User).filter_by(user_id=intent.user_id).first()
-    if not user:
-        return error_response("User not found", 404)
-    
-    user.inbox_quota += intent.amount
-
-    intent.status = PaymentStatus.CONFIRMED.value
+@payments_bp.route('/callback', methods=['GET'])
+def blockonomics_callback():
+    message, code = process_callback(
+        request.args.get('txid'),
+        request.args.get('value'),
+        request.args.get('addr'),
+        request.args.get('status'),
+    )
     db.session.commit()
+    if code != 200:
+        return error_response(message, code)
+    return jsonify({"message": message}), 200
+
+@payments_bp.route('/callback/replay', methods=['POST'])
+def replay_callbacks():
+    """Reconciles many payments at once from a JSON list of callbacks ({txid, value, addr, status}),
+    e.g. ones missed while the API was down. Requires the service SECRET as bearer token."""
+    secret = os.getenv('SECRET')
+    if not secret or request.headers.get('Authorization', '').split(' ')[-1] != secret:
+        return error_response("Unauthorized", 401)
 
-    return jsonify({"message": "Callback processed"}), 200
\ No newline at end of file
+    callbacks = request.get_json(silent=True)
+    if not isinstance(callbacks, list) or not all(isinstance(c, dict) for c in callbacks):
+        return error_response("Expected a JSON list of callbacks", 400)
+
+    results = {}
+    for callback in callbacks:
+        message, code = process_callback(
+            callback.get('txid'),
+            callback.get('value'),
+            callback.get('addr'),
+            callback.get('status'),
+        )
+        results[str(callback.get('txid'))] = message
+    # All confirmations land in one transaction
+    db.session.commit()
+    return jsonify({"results": results}), 200
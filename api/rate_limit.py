@@ -0,0 +1,137 @@
+"""Request rate limiting shared by all gunicorn workers.
+
+Each (scope, client) pair is a sliding-window counter: the counts of the current and
+the previous fixed window, with the previous one weighted by how much of it still
+overlaps the sliding window. That is three integers per key whatever the traffic, kept
+in a small SQLite file next to the database so every worker on the host sees the same
+counts. Keys idle for two windows are equivalent to no row and are swept out a few at a
+time, so the table only holds recently active clients.
+
+    @rate_limit('register', 3, 86400)            # 3 per client IP per day
+    @rate_limit('inbox', 60, 60, key=api_key_or_ip)
+"""
+
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from functools import wraps
+from flask import request, jsonify
+from config import app, instance_dir
+from auth_utils import current_principal
+
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', os.path.join(instance_dir, 'ratelimit.db'))
+SWEEP_PROBABILITY = 0.01   # share of requests that also delete a batch of stale keys
+SWEEP_BATCH = 500
+
+# One connection per worker process. A lock rather than threading.local, whose storage is
+# per greenlet under gevent workers, so a connection would be opened for every request.
+_lock = threading.Lock()
+_conn = None
+
+def connect():
+    """Returns the worker's connection; the caller holds _lock."""
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(RATE_LIMIT_DB, timeout=5, isolation_level=None, check_same_thread=False)
+        # Counters are disposable; losing the last writes in a crash is harmless
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=OFF;")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key          TEXT PRIMARY KEY,
+                window_start INTEGER NOT NULL,
+                current      INTEGER NOT NULL,
+                previous     INTEGER NOT NULL,
+                expires_at   INTEGER NOT NULL
+            );
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_rate_limits_expires ON rate_limits(expires_at);")
+        _conn = conn
+    return _conn
+
+def retry_after(current, previous, window, limit, period, now):
+    """Seconds from now until a key with these counts would be allowed one more request."""
+    if current < limit and previous:
+        # The previous window's weight may shrink enough before the current one ends
+        release = window + period * (previous - limit + current + 1) / previous
+        if release < window + period:
+            return max(1, math.ceil(release - now))
+    # Otherwise wait into the next window, where the current count becomes the weighted one
+    release = window + period
+    if current >= limit:
+        release += period * (current - limit + 1) / current
+    return max(1, math.ceil(release - now))
+
+def hit(key, limit, period, now=None):
+    """Counts one request against key. Returns (allowed, seconds until it would be)."""
+    now = now or time.time()
+    window = int(now // period) * period
+    with _lock:
+        return _hit(connect(), key, limit, period, now, window)
+
+def _hit(conn, key, limit, period, now, window):
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        row = conn.execute(
+            "SELECT window_start, current, previous FROM rate_limits WHERE key = ?;", (key,)
+        ).fetchone()
+        if row and row[0] == window:
+            current, previous = row[1], row[2]
+        elif row and row[0] == window - period:
+            current, previous = 0, row[1]
+        else:
+            current, previous = 0, 0
+
+        # previous * overlap + current + 1 <= limit, scaled by period to stay exact for whole seconds
+        allowed = previous * (window + period - now) + (current + 1) * period <= limit * period
+        if allowed:
+            current += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (key, window_start, current, previous, expires_at) "
+                "VALUES (?, ?, ?, ?, ?);",
+                (key, window, current, previous, window + 2 * period),
+            )
+        conn.execute("COMMIT;")
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+
+    if random.random() < SWEEP_PROBABILITY:
+        conn.execute(
+            "DELETE FROM rate_limits WHERE key IN "
+            "(SELECT key FROM rate_limits WHERE expires_at < ? LIMIT ?);",
+            (int(now), SWEEP_BATCH),
+        )
+
+    if allowed:
+        return True, 0
+    return False, retry_after(current, previous, window, limit, period, now)
+
+def client_ip():
+    # Set by ProxyFix from the address nginx appended, never from what the client sent
+    return request.remote_addr
+
+def api_key_or_ip():
+    principal = current_principal()
+    return principal.api_key if principal else client_ip()
+
+def rate_limit(scope, limit, period, key=client_ip):
+    """Rejects a view's requests with 429 once a client exceeds limit per period seconds."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            try:
+                allowed, retry_after = hit(f'{scope}:{key()}', limit, period)
+            except sqlite3.Error:
+                # Never turn a rate limiter fault into an outage
+                app.logger.exception(f"Rate limiter unavailable for {scope}")
+                return f(*args, **kwargs)
+            if not allowed:
+                response = jsonify({'error': f'Rate limit exceeded: {limit} requests per {period} seconds'})
+                return response, 429, {'Retry-After': str(retry_after)}
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,141 @@
+"""Message retention.
+
+A message expires `retention_days` after it arrived, taken from its inbox, else from the
+inbox's owner, else MESSAGE_RETENTION_DAYS. The purge deletes expired rows in small
+indexed batches and pauses between them, so /email ingestion never waits long for the
+write lock, then hands freed SQLite pages back to the filesystem a chunk at a time.
+"""
+
+import os
+import time
+from sqlalchemy import func, select, text
+from config import app, db, IS_SQLITE
+from db_models import Message, Inbox, User
+from blob_store import delete_blobs, stale_files
+from list_version import bump
+from constants import (MESSAGE_RETENTION_DAYS, RETENTION_BATCH_SIZE, RETENTION_BATCH_PAUSE,
+                       RETENTION_MAX_RUNTIME)
+
+VACUUM_PAGES_PER_STEP = 1000
+
+# Retention in days an inbox overrides the default with; NULL if it does not
+EFFECTIVE_DAYS = func.coalesce(Inbox.retention_days, User.retention_days)
+
+def inboxes_kept(condition):
+    """Subquery of the inboxes whose overridden retention matches condition."""
+    return select(Inbox.inbox).join(User, User.api_key == Inbox.api_key).where(condition)
+
+def retention_overrides():
+    """Returns the distinct non-default retentions, in days, that some inbox has."""
+    rows = db.session.execute(select(EFFECTIVE_DAYS).select_from(Inbox).join(
+        User, User.api_key == Inbox.api_key
+    ).where(EFFECTIVE_DAYS.isnot(None), EFFECTIVE_DAYS != MESSAGE_RETENTION_DAYS).distinct())
+    return sorted(days for days, in rows)
+
+def purge_batch(conditions, batch_size):
+    """Deletes up to batch_size of the oldest messages matching conditions.
+    Returns (rows, inline bytes, blob hashes) of what was deleted."""
+    rows = db.session.query(
+        Message.id, Message.blob_hash, func.coalesce(func.length(Message.content), 0), Message.api_key
+    ).filter(*conditions).order_by(Message.timestamp).limit(batch_size).all()
+    if rows:
+        db.session.query(Message).filter(
+            Message.id.in_([row[0] for row in rows])
+        ).delete(synchronize_session=False)
+        bump(row.api_key for row in rows)
+    db.session.commit()
+    return len(rows), sum(row[2] for row in rows), {row[1] for row in rows if row[1]}
+
+def collect_orphan_blobs(batch_size=RETENTION_BATCH_SIZE):
+    """Deletes blob files that no message references, such as those written by an ingest
+    whose transaction rolled back. Returns the number of files and bytes removed."""
+    removed = freed = 0
+    batch = set()
+
+    def collect(digests):
+        used = {row.blob_hash for row in db.session.query(Message.blob_hash).filter(
+            Message.blob_hash.in_(digests)).distinct()}
+        db.session.commit()
+        return delete_blobs(digests - used)
+
+    for digest, path in stale_files():
+        if digest is None:
+            # A temporary file put_blob never renamed into place
+            try:
+                freed += os.path.getsize(path)
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            continue
+        batch.add(digest)
+        if len(batch) == batch_size:
+            files, size = collect(batch)
+            removed, freed, batch = removed + files, freed + size, set()
+    if batch:
+        files, size = collect(batch)
+        removed, freed = removed + files, freed + size
+    if removed:
+        app.logger.info(f"Removed {removed} unreferenced blob files ({freed} bytes)")
+    return removed, freed
+
+def reclaim_space(deadline):
+    """Returns free pages to the filesystem; needs auto_vacuum=INCREMENTAL (migration 6)."""
+    if not IS_SQLITE:
+        return 0
+    page_size = db.session.execute(text('PRAGMA page_size')).scalar()
+    free_before = free = db.session.execute(text('PRAGMA freelist_count')).scalar()
+    while free and time.monotonic() < deadline:
+        db.session.execute(text(f'PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})'))
+        db.session.commit()
+        free = db.session.execute(text('PRAGMA freelist_count')).scalar()
+        time.sleep(RETENTION_BATCH_PAUSE)
+    return (free_before - free) * page_size
+
+def purge_messages(now=None):
+    """Runs one retention pass and returns what it purged."""
+    now = now or time.time()
+    deadline = time.monotonic() + RETENTION_MAX_RUNTIME
+
+    def cutoff(days):
+        return int(now - days * 86400)
+
+    # The default sweep skips inboxes kept longer; each distinct override gets one sweep
+    sweeps = [(Message.timestamp < cutoff(MESSAGE_RETENTION_DAYS),
+               Message.inbox.not_in(inboxes_kept(EFFECTIVE_DAYS > MESSAGE_RETENTION_DAYS)))]
+    sweeps += [(Message.timestamp < cutoff(days), Message.inbox.in_(inboxes_kept(EFFECTIVE_DAYS == days)))
+               for days in retention_overrides()]
+
+    deleted = inline_bytes = 0
+    blob_hashes = set()
+    complete = True
+    for conditions in sweeps:
+        while True:
+            if time.monotonic() >= deadline:
+                complete = False
+                break
+            rows, size, hashes = purge_batch(conditions, RETENTION_BATCH_SIZE)
+            deleted += rows
+            inline_bytes += size
+            blob_hashes |= hashes
+            if rows < RETENTION_BATCH_SIZE:
+                break
+            time.sleep(RETENTION_BATCH_PAUSE)
+        if not complete:
+            break
+
+    # Blobs are shared between messages with identical bodies; only drop unreferenced ones
+    blobs_removed = blob_bytes = 0
+    if blob_hashes:
+        still_used = {row.blob_hash for row in db.session.query(Message.blob_hash).filter(
+            Message.blob_hash.in_(blob_hashes)).distinct()}
+        blobs_removed, blob_bytes = delete_blobs(blob_hashes - still_used)
+
+    reclaimed = reclaim_space(deadline) if deleted else 0
+    if deleted or blobs_removed:
+        app.logger.info(
+            f"Retention purged {deleted} messages ({inline_bytes} bytes inline, {blobs_removed} blobs / "
+            f"{blob_bytes} bytes), reclaimed {reclaimed} bytes"
+            + ("" if complete else "; the rest continues next run"))
+    return dict(messages=deleted, inline_bytes=inline_bytes, blobs=blobs_removed,
+                blob_bytes=blob_bytes, reclaimed_bytes=reclaimed, complete=complete)
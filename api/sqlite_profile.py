@@ -0,0 +1,32 @@
+import os
+
+# PRAGMAs applied to every new SQLite connection, by profile. "production" uses WAL so
+# /email ingestion commits no longer block readers, and waits on a busy lock instead of
+# failing with "database is locked". "legacy" is SQLite's stock rollback-journal setup.
+SQLITE_PROFILES = {
+    'legacy': {},
+    'production': {
+        # Must precede table creation; existing databases are converted by migration 6
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,           # ms
+        'mmap_size': 256 << 20,
+        'cache_size': -64000,           # negative = KiB, i.e. 64 MB per connection
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 1000,     # pages
+    },
+}
+
+SQLITE_PROFILE = os.getenv('SQLITE_PROFILE', 'production')
+
+# jobs.py runs a TRUNCATE checkpoint this often so the WAL file can't grow
+# unbounded while readers keep autocheckpoints from completing
+WAL_CHECKPOINT_MINUTES = 10
+
+def apply_pragmas(dbapi_connection, profile=None):
+    pragmas = SQLITE_PROFILES[profile or SQLITE_PROFILE]
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
@@ -1,18 +1,30 @@
-from flask import request
+from flask import request, Response, stream_with_context, send_file
 from config import app,db
-from db_models import Message, Inbox, User
+from db_models import Message, Inbox, User, Counter
 from email.parser import Parser
 from uuid import uuid4
 from functools import wraps
 from flask import abort
 import time
+from datetime import datetime
 import os
 import json
-import random
+import base64
+import zlib
 import re
 import logging
-from words import adjectives, nouns
-from auth_utils import auth_required, get_api_key_from_token
+from sqlalchemy.exc import IntegrityError
+from mailbox_names import allocate_addresses, NamespaceExhausted
+from auth_utils import auth_required
+from list_version import bump, conditional
+from rate_limit import rate_limit, api_key_or_ip
+from constants import (MESSAGES_PAGE_SIZE, MESSAGES_MAX_PAGE_SIZE, LONG_POLL_DEFAULT_TIMEOUT,
+                       LONG_POLL_MAX_TIMEOUT, LONG_POLL_RECHECK_INTERVAL, STREAM_HEARTBEAT_INTERVAL,
+                       INBOX_INSERT_ATTEMPTS, MAX_INBOXES_PER_REQUEST, INBOX_RATE_LIMIT, EMAIL_RATE_LIMIT)
+from notifier import inbox_notifier, api_key_notifier
+from message_summary import summarize_email
+from codec import compress, decompress
+from blob_store import BLOB_THRESHOLD, blob_path, put_blob, read_blob
 
 FLASK_ENV = os.getenv('FLASK_ENV', 'production')
 IS_DEV = FLASK_ENV == 'development'
@@ -24,7 +36,8 @@ if IS_DEV:
     CORS(
         app,
         supports_credentials=True,
-        origins=["http://localhost:8000"]  # must match your frontend origin exactly
+        origins=["http://localhost:8000"],  # must match your frontend origin exactly
+        expose_headers=["X-Next-Cursor"],
     )
 
 
@@ -42,109 +55,219 @@ DOMAIN = os.getenv('DOMAIN')
 app.register_blueprint(auth_bp, url_prefix=url_prefix + '/auth')
 app.register_blueprint(payments_bp, url_prefix=url_prefix + '/payments')
 
+# Every worker schedules the background jobs; a lease makes only one of them run each job
+import jobs
+jobs.start()
+import payment_monitor
+payment_monitor.start()
+
+def encode_cursor(seq):
+    raw = f'seq:{seq}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    kind, seq = base64.urlsafe_b64decode(padded).decode().split(':', 1)
+    if kind != 'seq':
+        raise ValueError(f"Unknown cursor kind {kind}")
+    return int(seq)
+
+def load_content(row):
+    '''Returns the raw JSON body, whether stored inline (compressed) or in the blob store'''
+    if row.blob_hash:
+        return read_blob(row.blob_hash)
+    return decompress(row.content)
+
+def serialize_message(row):
+    try:
+        # Parse the JSON content blob
+        content = load_content(row)
+        content_json = json.loads(content.decode('utf-8')) if content else {}
+
+        # Extract relevant fields
+        html_body = content_json.get('html_body', '')
+        text_body = content_json.get('text_body', '')
+        sender = content_json.get('sender', 'Unknown')
+
+        # Get sender from headers if available
+        headers = content_json.get('headers', {})
+        from_header = headers.get('From', sender)
+    except (json.JSONDecodeError, UnicodeDecodeError, zlib.error, OSError):
+        # Fallback for malformed content
+        html_body, text_body, from_header = '', '', 'Unknown'
+
+    return dict(
+        id=row.id,
+        inbox=row.inbox,
+        subject=row.subject,
+        html_body=html_body,
+        text_body=text_body,
+        sender=from_header,
+        timestamp=row.timestamp,
+        seq=row.seq
+    )
+
+SUMMARY_COLUMNS = [Message.sender, Message.snippet, Message.size, Message.has_html]
+
+def summarize_row(row):
+    return dict(
+        id=row.id,
+        inbox=row.inbox,
+        subject=row.subject,
+        sender=row.sender,
+        snippet=row.snippet,
+        size=row.size,
+        has_html=row.has_html,
+        timestamp=row.timestamp,
+        seq=row.seq
+    )
+
 @app.route(f'{url_prefix}/messages', methods=['GET'])
 @auth_required
-def get_messages(token):
-    '''Returns message list(id, inbox, subject, content, timestamp, sender)'''
-    api_key = get_api_key_from_token(token)
-    messages = db.session.query(
-        Message.id, 
-        Message.inbox, 
-        Message.subject, 
-        Message.content,
-        Message.timestamp
-    ).join(
-        Inbox, Message.inbox == Inbox.inbox
-    ).filter(
-        Inbox.api_key==api_key
-    ).order_by(
-        Message.timestamp.desc()
-    ).all()
-    
-    if not messages:
-        messages = []
+@conditional
+def get_messages(principal):
+    '''Returns a page of messages(id, inbox, subject, content, timestamp, sender), newest first
+
+    Query params: inbox, since (unix timestamp), limit, cursor (from the X-Next-Cursor
+    header of the previous page) and summary=1 to return the precomputed sender, snippet,
+    size and has_html columns instead of reading the message bodies.
+    '''
+    api_key = principal.api_key
+    inbox = request.args.get('inbox')
+    since = request.args.get('since', type=int)
+    limit = request.args.get('limit', MESSAGES_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MESSAGES_MAX_PAGE_SIZE))
+    summary = request.args.get('summary') in ('1', 'true')
+    cursor = request.args.get('cursor')
+    try:
+        before_seq = decode_cursor(cursor) if cursor else None
+    except (ValueError, UnicodeDecodeError):
+        return "Invalid cursor", 400
+
+    columns = [Message.id, Message.inbox, Message.subject, Message.timestamp, Message.seq]
+    columns += SUMMARY_COLUMNS if summary else [Message.content, Message.blob_hash]
+    # Served by (api_key, seq), or by (inbox, seq) for one inbox, so a page reads about
+    # `limit` index entries however large the mailbox is
+    if inbox:
+        owned = db.session.query(Inbox.inbox).filter(Inbox.api_key==api_key, Inbox.inbox==inbox).first()
+        if not owned:
+            return [], 200
+        query = db.session.query(*columns).filter(Message.inbox == inbox)
+    else:
+        query = db.session.query(*columns).filter(Message.api_key == api_key)
+    if since is not None:
+        query = query.filter(Message.timestamp >= since)
+    if before_seq is not None:
+        query = query.filter(Message.seq < before_seq)
+    # seq rather than the second-resolution timestamp, so the first message listed is
+    # the one /inbox/<address>/wait?after= treats as newest
+    rows = query.order_by(Message.seq.desc()).limit(limit + 1).all()
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(rows[-1].seq)
+
+    if summary:
+        messages = [summarize_row(row) for row in rows]
     else:
-        result_messages = []
-        for row in messages:
-            try:
-                # Parse the JSON content blob
-                content_json = json.loads(row.content.decode('utf-8')) if row.content else {}
-                
-                # Extract relevant fields
-                html_body = content_json.get('html_body', '')
-                text_body = content_json.get('text_body', '')
-                sender = content_json.get('sender', 'Unknown')
-                
-                # Get sender from headers if available
-                headers = content_json.get('headers', {})
-                from_header = headers.get('From', sender)
-                
-                result_messages.append(dict(
-                    id=row.id,
-                    inbox=row.inbox, 
-                    subject=row.subject,
-                    html_body=html_body,
-                    text_body=text_body,
-                    sender=from_header,
-                    timestamp=row.timestamp
-                ))
-            except (json.JSONDecodeError, UnicodeDecodeError):
-                # Fallback for malformed content
-                result_messages.append(dict(
-                    id=row.id,
-                    inbox=row.inbox, 
-                    subject=row.subject,
-                    html_body='',
-                    text_body='',
-                    sender='Unknown',
-                    timestamp=row.timestamp
-                ))
-        
-        messages = result_messages
-        
-    return messages
+        messages = [serialize_message(row) for row in rows]
+
+    return messages, 200, headers
 
 @app.route(f'{url_prefix}/message/<msgid>', methods=['GET'])
 @auth_required
-def get_message(token, msgid):
+def get_message(principal, msgid):
     '''Returns message content for the given message id'''
-    api_key = get_api_key_from_token(token)
-    row = db.session.query(Message.content).join(Inbox, Message.inbox == Inbox.inbox).filter(Inbox.api_key==api_key).filter(Message.id==msgid).first()
+    api_key = principal.api_key
+    row = db.session.query(Message.content, Message.blob_hash).filter(Message.api_key==api_key).filter(Message.id==msgid).first()
     if not row:
         return "msgid doesn't exist", 404
-        
-    return row.content, 200
 
-def get_mailboxname():
-    adjective_part = '.'.join(random.choices(adjectives, k=2))
-    noun = random.choice(nouns)
-    return f'{adjective_part}.{noun}'
+    # Large bodies are kept uncompressed on disk so they can be sent straight from the file
+    if row.blob_hash:
+        try:
+            body = open(blob_path(row.blob_hash), 'rb')
+        except FileNotFoundError:
+            app.logger.error(f"Blob {row.blob_hash} of message {msgid} is missing")
+            return "message body not found", 404
+        return send_file(body, mimetype='application/json')
+    # Bodies are stored compressed; this is the only endpoint that serves them whole
+    return decompress(row.content), 200, {'Content-Type': 'application/json'}
+
+def create_inboxes(api_key, count):
+    '''Takes count from the user's quota and creates count new inboxes in one transaction
 
-def is_quota_available(api_key):
-    row = db.session.query(User).filter(User.api_key==api_key,User.inbox_quota>0).first()
-    if row:
-        return True
-    return False
+    Returns the new addresses, or None if the quota is below count. Raises
+    NamespaceExhausted when no free names can be found.
+    '''
+    for attempt in range(INBOX_INSERT_ATTEMPTS):
+        # Conditional, so concurrent requests can never take the quota below zero
+        reserved = db.session.query(User).filter(
+            User.api_key==api_key, User.inbox_quota>=count
+        ).update({"inbox_quota": User.inbox_quota-count, "list_version": User.list_version+1},
+                 synchronize_session=False)
+        if not reserved:
+            db.session.rollback()
+            return None
+        try:
+            addresses = allocate_addresses(count, DOMAIN)
+            created_at = datetime.utcnow()
+            db.session.execute(db.insert(Inbox), [
+                dict(api_key=api_key, inbox=address, created_at=created_at) for address in addresses
+            ])
+            db.session.commit()
+            return addresses
+        except IntegrityError:
+            # Another request took one of the addresses since we checked; start over
+            db.session.rollback()
+        except NamespaceExhausted:
+            db.session.rollback()
+            raise
+    raise NamespaceExhausted("Concurrent requests kept taking the allocated addresses")
 
 @app.route(f'{url_prefix}/inbox', methods=['POST']) 
+@rate_limit('inbox', *INBOX_RATE_LIMIT, key=api_key_or_ip)
 @auth_required
-def create_mailbox(token):
+def create_mailbox(principal):
     '''Creates new inbox'''
-    api_key = get_api_key_from_token(token)
-    if not is_quota_available(api_key):
+    try:
+        addresses = create_inboxes(principal.api_key, 1)
+    except NamespaceExhausted as e:
+        app.logger.error(f"Inbox allocation failed: {e}")
+        return "No free inbox names", 503
+    if addresses is None:
         return "Insufficient Inbox quota", 403
-    email_address = f'{get_mailboxname()}@{DOMAIN}'
-    db.session.add(Inbox(api_key=api_key, inbox=email_address))
-    #We used one inbox, decrease quota
-    db.session.query(User).filter(User.api_key==api_key).update({"inbox_quota":User.inbox_quota-1}) 
-    db.session.commit()
-    return email_address, 201
+    return addresses[0], 201
+
+@app.route(f'{url_prefix}/inboxes', methods=['POST'])
+@rate_limit('inbox', *INBOX_RATE_LIMIT, key=api_key_or_ip)
+@auth_required
+def create_mailboxes(principal):
+    '''Creates `count` inboxes at once (query param or JSON body), all or none
+
+    Returns {"inboxes": [address, ...]}; each inbox consumes 1 from the quota.
+    '''
+    count = request.args.get('count', type=int)
+    if count is None and request.is_json:
+        count = (request.get_json(silent=True) or {}).get('count')
+    if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_INBOXES_PER_REQUEST:
+        return f"count must be between 1 and {MAX_INBOXES_PER_REQUEST}", 400
+    try:
+        addresses = create_inboxes(principal.api_key, count)
+    except NamespaceExhausted as e:
+        app.logger.error(f"Inbox allocation failed: {e}")
+        return "No free inbox names", 503
+    if addresses is None:
+        return "Insufficient Inbox quota", 403
+    return {'inboxes': addresses}, 201
 
 @app.route(f'{url_prefix}/inboxes', methods=['GET']) 
 @auth_required
-def get_mailboxes(token):
+@conditional
+def get_mailboxes(principal):
     '''Get inboxes belonging to the authenticated user, ordered by newest first'''
-    api_key = get_api_key_from_token(token)
+    api_key = principal.api_key
     inboxes = db.session.execute(
         db.select(Inbox)
           .filter(Inbox.api_key == api_key)
@@ -158,28 +281,208 @@ def get_mailboxes(token):
 
     return result
 
-def query_inbox(inbox):
-    inbox = db.session.execute(db.select(Inbox).filter(Inbox.inbox==inbox)).first()
-    return inbox
+def reserve_seq(count):
+    '''Draws count consecutive values from the messages counter and returns the first
+
+    The UPDATE holds the counter row's lock until the caller commits, so ingest
+    transactions commit in seq order: a reader that sees some seq has seen every
+    smaller one too, and "seq > last seen" never skips a message.
+    '''
+    drawn = db.session.query(Counter).filter(Counter.name == 'messages').update(
+        {'value': Counter.value + count}, synchronize_session=False)
+    if not drawn:
+        # A new database; the first message creates the counter
+        db.session.add(Counter(name='messages', value=count))
+        db.session.flush()
+    return current_seq() - count + 1
+
+def current_seq():
+    '''seq of the newest message committed so far'''
+    return db.session.query(Counter.value).filter(Counter.name == 'messages').scalar() or 0
+
+@app.route(f'{url_prefix}/inbox/<address>/wait', methods=['GET'])
+@auth_required
+def wait_for_messages(principal, address):
+    '''Blocks until a message newer than `after` (a message id) or `after_seq` lands in the inbox
+
+    Returns the new messages, newest first, or 204 once `timeout` seconds pass. Without
+    either, only messages arriving after the request count as new. Both responses carry
+    X-Last-Seq, the newest seq accounted for; passing it back as `after_seq` continues
+    without a gap.
+    '''
+    api_key = principal.api_key
+    owned = db.session.query(Inbox.inbox).filter(
+        Inbox.api_key==api_key, Inbox.inbox==address
+    ).first()
+    if not owned:
+        return "inbox doesn't exist", 404
+
+    timeout = request.args.get('timeout', LONG_POLL_DEFAULT_TIMEOUT, type=int)
+    timeout = max(0, min(timeout, LONG_POLL_MAX_TIMEOUT))
+    after = request.args.get('after')
+    after_seq = request.args.get('after_seq', type=int)
+    if after:
+        after_seq = db.session.query(Message.seq).filter(
+            Message.inbox==address, Message.id==after
+        ).scalar()
+        if after_seq is None:
+            return "msgid doesn't exist", 404
+    elif after_seq is None:
+        after_seq = current_seq()
+
+    deadline = time.monotonic() + timeout
+    # Subscribe before the first check so a message committed in between still wakes us
+    event = inbox_notifier.subscribe(address)
+    try:
+        while True:
+            event.clear()
+            rows = db.session.query(
+                Message.id, Message.inbox, Message.subject, Message.timestamp, Message.seq,
+                Message.content, Message.blob_hash
+            ).filter(
+                Message.inbox == address, Message.seq > after_seq
+            ).order_by(Message.seq.desc()).limit(MESSAGES_PAGE_SIZE).all()
+            if rows:
+                return [serialize_message(row) for row in rows], 200, {'X-Last-Seq': str(rows[0].seq)}
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return '', 204, {'X-Last-Seq': str(after_seq)}
+            # Don't hold a read transaction open while parked
+            db.session.rollback()
+            # Wake-ups only reach this worker, so re-check periodically for mail
+            # ingested by the other gunicorn workers
+            event.wait(min(remaining, LONG_POLL_RECHECK_INTERVAL))
+    finally:
+        inbox_notifier.unsubscribe(address, event)
+
+def format_event(row):
+    data = json.dumps(dict(id=row.id, inbox=row.inbox, subject=row.subject,
+                           sender=row.sender, timestamp=row.timestamp, seq=row.seq))
+    return f'id: {row.seq}\nevent: message\ndata: {data}\n\n'
+
+@app.route(f'{url_prefix}/messages/stream', methods=['GET'])
+@auth_required
+def stream_messages(principal):
+    '''Server-Sent Events stream of (id, inbox, subject, sender, timestamp) for new messages
+
+    Event ids are message seqs, so a reconnect resumes right after the Last-Event-ID the
+    browser sends. Run gunicorn with
+    gevent workers so idle streams don't each pin a worker.
+    '''
+    api_key = principal.api_key
+    columns = (Message.id, Message.inbox, Message.subject, Message.timestamp, Message.sender, Message.seq)
+
+    def owned(*cols):
+        return db.session.query(*cols).filter(Message.api_key==api_key)
+
+    # Resume after the last delivered event, otherwise start from the newest message
+    newest = current_seq()
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    after_seq = int(last_event_id) if last_event_id.isdigit() else newest
+    # A stale or foreign id can never be ahead of the counter
+    after_seq = min(after_seq, newest)
+
+    def generate(after_seq):
+        event = api_key_notifier.subscribe(api_key)
+        last_sent = time.monotonic()
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                event.clear()
+                rows = owned(*columns).filter(Message.seq > after_seq).order_by(
+                    Message.seq.asc()
+                ).limit(MESSAGES_PAGE_SIZE).all()
+                for row in rows:
+                    yield format_event(row)
+                    after_seq = row.seq
+                if rows:
+                    last_sent = time.monotonic()
+                    continue
+                if time.monotonic() - last_sent >= STREAM_HEARTBEAT_INTERVAL:
+                    yield ': keepalive\n\n'
+                    last_sent = time.monotonic()
+                # Don't hold a read transaction open while idle
+                db.session.rollback()
+                event.wait(LONG_POLL_RECHECK_INTERVAL)
+        finally:
+            api_key_notifier.unsubscribe(api_key, event)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate(after_seq)),
+                    mimetype='text/event-stream', headers=headers)
+
+def is_ingest_authorized():
+    secret = request.headers.get('Authorization', '').split(' ')[-1]
+    return secret == os.getenv('SECRET')
+
+def ingest_required(f):
+    '''Rejects requests without the ingest secret; goes above @rate_limit, so they never count'''
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if not is_ingest_authorized():
+            return '', 403
+        return f(*args, **kwargs)
+    return wrapper
+
+def store_emails(emails):
+    '''Stores each email once per recipient inbox it was addressed to, in one transaction
+
+    Returns the number of messages created.
+    '''
+    recipients = {recipient for email_data in emails for recipient in email_data.get('recipients', [])}
+    if not recipients:
+        return 0
+    # Addresses are unique, so each has one owner
+    owners = dict(db.session.query(Inbox.inbox, Inbox.api_key).filter(Inbox.inbox.in_(recipients)))
+
+    timestamp = int(time.time())
+    rows = []
+    for email_data in emails:
+        delivered = [r for r in dict.fromkeys(email_data.get('recipients', [])) if r in owners]
+        if not delivered:
+            continue
+        raw_content = json.dumps(email_data).encode()
+        summary = summarize_email(email_data, len(raw_content))
+        if len(raw_content) >= BLOB_THRESHOLD:
+            content, blob_hash = None, put_blob(raw_content)
+        else:
+            content, blob_hash = compress(raw_content), None
+        subject = email_data.get("headers", {}).get("Subject")
+        if subject:
+            subject = subject[:250]  # PostgreSQL enforces the column length
+        for recipient in delivered:
+            rows.append(dict(id=str(uuid4())[:8], inbox=recipient, api_key=owners[recipient], timestamp=timestamp,
+                             subject=subject, content=content, blob_hash=blob_hash, **summary))
+    if not rows:
+        return 0
+
+    first_seq = reserve_seq(len(rows))
+    for offset, row in enumerate(rows):
+        row['seq'] = first_seq + offset
+    db.session.execute(db.insert(Message), rows)
+    bump(row['api_key'] for row in rows)
+    db.session.commit()
+    for inbox in {row['inbox'] for row in rows}:
+        inbox_notifier.notify(inbox)
+        api_key_notifier.notify(owners[inbox])
+    return len(rows)
 
 @app.route('/email', methods=['POST'])
+@ingest_required
+@rate_limit('email', *EMAIL_RATE_LIMIT)
 def create_email():
-    email_data = request.json
-    secret = request.headers.get('Authorization').split(' ')[-1]
-
-    if secret != os.getenv('SECRET'):
-       return '', 403
-    for recipient in email_data['recipients']:
-        if query_inbox(recipient):
-            msg_id = str(uuid4())[:8]
-            timestamp = int(time.time())
-            subject = email_data.get("headers", {}).get("Subject")
-            db.session.add(Message(id=msg_id, inbox=recipient, timestamp=timestamp, 
-                                   subject = subject,
-                                   content=json.dumps(email_data).encode()))
-            db.session.commit()
-
+    store_emails([request.json])
     return '', 201
 
+@app.route('/emails', methods=['POST'])
+@ingest_required
+@rate_limit('email', *EMAIL_RATE_LIMIT)
+def create_emails():
+    '''Batch form of /email: accepts a JSON list of emails and commits them together'''
+    emails = request.json
+    if not isinstance(emails, list):
+        return "Expected a JSON list of emails", 400
+    return {'stored': store_emails(emails)}, 201
+
 if __name__ == '__main__':
     app.run(port=5000, use_reloader=True)
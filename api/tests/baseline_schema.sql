@@ -0,0 +1,74 @@
+-- The schema create_db built before the first versioned migration. Tests upgrade it
+-- through every migration to check they produce what the models declare.
+CREATE TABLE messages (
+	id VARCHAR(16) NOT NULL, 
+	inbox VARCHAR(250), 
+	subject VARCHAR(250), 
+	timestamp BIGINT, 
+	content BLOB, 
+	PRIMARY KEY (id)
+);
+CREATE INDEX ix_messages_inbox ON messages (inbox);
+CREATE TABLE inboxes (
+	api_key VARCHAR(250) NOT NULL, 
+	inbox VARCHAR(250) NOT NULL, 
+	created_at DATETIME, 
+	connected_services JSON, 
+	PRIMARY KEY (api_key, inbox)
+);
+CREATE TABLE users (
+	user_id VARCHAR(255) NOT NULL, 
+	username VARCHAR(255) NOT NULL, 
+	api_key VARCHAR(250) NOT NULL, 
+	inbox_quota INTEGER, 
+	created_at DATETIME, 
+	PRIMARY KEY (user_id), 
+	UNIQUE (username), 
+	UNIQUE (api_key)
+);
+CREATE TABLE auth_challenges (
+	id VARCHAR NOT NULL, 
+	address VARCHAR(42) NOT NULL, 
+	nonce VARCHAR(20) NOT NULL, 
+	message TEXT NOT NULL, 
+	timestamp INTEGER NOT NULL, 
+	expires_at DATETIME NOT NULL, 
+	PRIMARY KEY (id)
+);
+CREATE TABLE passkey_challenges (
+	challenge_id VARCHAR(255) NOT NULL, 
+	username VARCHAR(255), 
+	credential_id VARCHAR(1000), 
+	challenge VARCHAR(1000) NOT NULL, 
+	operation_type VARCHAR(20) NOT NULL, 
+	created_at DATETIME, 
+	expires_at DATETIME NOT NULL, 
+	PRIMARY KEY (challenge_id)
+);
+CREATE TABLE payment_intents (
+	txhash VARCHAR(66) NOT NULL, 
+	user_id VARCHAR(255) NOT NULL, 
+	created_at DATETIME, 
+	amount INTEGER, 
+	status VARCHAR(1) NOT NULL, 
+	PRIMARY KEY (txhash)
+);
+CREATE TABLE passkey_credentials (
+	credential_id VARCHAR(1000) NOT NULL, 
+	user_id VARCHAR(255) NOT NULL, 
+	public_key TEXT NOT NULL, 
+	counter BIGINT, 
+	device_type VARCHAR(50), 
+	created_at DATETIME, 
+	last_used DATETIME, 
+	PRIMARY KEY (credential_id), 
+	FOREIGN KEY(user_id) REFERENCES users (user_id)
+);
+CREATE TABLE user_sessions (
+	token VARCHAR NOT NULL, 
+	user_id VARCHAR(255) NOT NULL, 
+	login_time INTEGER NOT NULL, 
+	expires_at DATETIME NOT NULL, 
+	PRIMARY KEY (token), 
+	FOREIGN KEY(user_id) REFERENCES users (user_id)
+);
@@ -0,0 +1,67 @@
+"""Runs the API against a throwaway SQLite database, without the background threads.
+
+    cd api && pipenv run test
+"""
+
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+_tmp = tempfile.mkdtemp(prefix='emptyinbox-tests-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_tmp, "emptyinbox.db")}'
+os.environ['RATE_LIMIT_DB'] = os.path.join(_tmp, 'ratelimit.db')
+os.environ['BLOB_DIR'] = os.path.join(_tmp, 'blobs')
+os.environ['SECRET'] = 'test-secret'
+os.environ.pop('FLASK_ENV', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jobs
+import payment_monitor
+# Tests run the scheduled jobs and the payment monitor themselves
+jobs.start = lambda: None
+payment_monitor.start = lambda: None
+
+# Importing the app registers every blueprint
+from tempmail_api import app
+from config import db
+from db_models import User, UserSession
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    with app.app_context():
+        db.create_all()
+    yield
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user():
+    '''Creates a user and returns (user_id, api_key)'''
+    def make(inbox_quota=5):
+        user_id, api_key = str(uuid.uuid4()), uuid.uuid4().hex
+        with app.app_context():
+            db.session.add(User(user_id=user_id, username=f'user-{api_key[:12]}',
+                                api_key=api_key, inbox_quota=inbox_quota))
+            db.session.commit()
+        return user_id, api_key
+    return make
+
+
+@pytest.fixture
+def make_session():
+    '''Creates a login session for a user and returns its token'''
+    def make(user_id):
+        token = uuid.uuid4().hex + uuid.uuid4().hex
+        with app.app_context():
+            db.session.add(UserSession(token, user_id, 0))
+            db.session.commit()
+        return token
+    return make
@@ -0,0 +1,65 @@
+"""Each request resolves its principal with at most one identity query (auth_utils.py)."""
+
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from config import app, db
+
+
+@contextmanager
+def identity_queries(token):
+    '''Collects the SELECTs that resolve this token to a user, as a session token or API key
+
+    Views query by the API key too, so only lookups of user_sessions or of the user id count.
+    '''
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        values = parameters.values() if isinstance(parameters, dict) else parameters
+        if token in values and ('FROM user_sessions' in statement or
+                                'FROM users \nWHERE users.api_key' in statement and 'users.user_id' in statement):
+            statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def request(client, endpoint, headers):
+    if endpoint == 'monitor':
+        return client.post('/payments/monitor', headers=headers,
+                           json={'txhash': f'0x{headers["X-Test-Id"]}', 'quotaAmount': 10})
+    return client.get(endpoint, headers=headers)
+
+
+@pytest.mark.parametrize('endpoint', ['/messages', '/auth/me', 'monitor'])
+@pytest.mark.parametrize('credential', ['api_key', 'session'])
+def test_one_identity_query_per_request(client, make_user, make_session, endpoint, credential):
+    user_id, api_key = make_user()
+    token = api_key if credential == 'api_key' else make_session(user_id)
+    headers = {'Authorization': f'Bearer {token}', 'X-Test-Id': token[:16]}
+
+    with identity_queries(token) as cold:
+        response = request(client, endpoint, headers)
+    assert response.status_code < 400
+    assert len(cold) == 1
+
+    # Later requests are served from the principal cache
+    headers['X-Test-Id'] = token[16:32]
+    with identity_queries(token) as warm:
+        response = request(client, endpoint, headers)
+    assert response.status_code < 400
+    assert len(warm) == 0
+
+
+def test_unknown_token_is_one_query(client):
+    with identity_queries('not-a-real-token') as statements:
+        response = client.get('/messages', headers={'Authorization': 'Bearer not-a-real-token'})
+    assert response.status_code == 401
+    assert len(statements) == 1
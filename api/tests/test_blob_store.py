@@ -0,0 +1,65 @@
+"""Large bodies on disk: serving them and collecting unreferenced files (blob_store.py, retention.py)."""
+
+import os
+import time
+
+import pytest
+
+import blob_store
+from config import app, db
+from db_models import Message
+from retention import collect_orphan_blobs
+
+INGEST = {'Authorization': 'Bearer test-secret'}
+OLD = time.time() - blob_store.BLOB_GC_GRACE - 60
+
+
+@pytest.fixture
+def inbox(client, make_user):
+    _, api_key = make_user(inbox_quota=1)
+    headers = {'Authorization': f'Bearer {api_key}'}
+    return headers, client.post('/inbox', headers=headers).get_data(as_text=True)
+
+
+def ingest_large(client, headers, address, text):
+    email = {'recipients': [address], 'headers': {'Subject': 'large'},
+             'text_body': text * (blob_store.BLOB_THRESHOLD // len(text) + 1)}
+    assert client.post('/emails', json=[email], headers=INGEST).get_json() == {'stored': 1}
+    [message] = client.get('/messages', headers=headers).get_json()
+    return message['id']
+
+
+def blob_of(msgid):
+    with app.app_context():
+        return blob_store.blob_path(db.session.get(Message, msgid).blob_hash)
+
+
+def test_missing_blob_is_a_404(client, inbox):
+    headers, address = inbox
+    msgid = ingest_large(client, headers, address, 'missing body ')
+    response = client.get(f'/message/{msgid}', headers=headers)
+    assert response.status_code == 200 and b'missing body' in response.data
+    response.close()
+
+    os.remove(blob_of(msgid))
+    assert client.get(f'/message/{msgid}', headers=headers).status_code == 404
+
+
+def test_unreferenced_files_are_collected_after_the_grace_period(client, inbox):
+    headers, address = inbox
+    msgid = ingest_large(client, headers, address, 'kept body ')
+    referenced = blob_of(msgid)
+    # Written by an ingest that rolled back, and a temporary file of an interrupted one
+    orphan = blob_store.blob_path(blob_store.put_blob(b'never committed'))
+    leftover = os.path.join(os.path.dirname(orphan), 'tmpabc123')
+    open(leftover, 'wb').close()
+    recent = blob_store.blob_path(blob_store.put_blob(b'being ingested right now'))
+    for path in (referenced, orphan, leftover):
+        os.utime(path, (OLD, OLD))
+
+    with app.app_context():
+        removed, _ = collect_orphan_blobs(batch_size=2)
+    assert removed >= 2
+    assert not os.path.exists(orphan) and not os.path.exists(leftover)
+    assert os.path.exists(referenced) and os.path.exists(recent)
+    assert client.get(f'/message/{msgid}', headers=headers).status_code == 200
@@ -0,0 +1,48 @@
+"""Address allocation escalates on a high collision rate, not a single collision (mailbox_names.py)."""
+
+import itertools
+
+import pytest
+
+import mailbox_names
+from config import app, db
+from db_models import Inbox
+
+
+@pytest.fixture
+def names(monkeypatch):
+    '''Makes tier 0 draw from a fixed cycle of names; other tiers stay random'''
+    def use(cycle):
+        tier0 = itertools.cycle(cycle)
+        real = mailbox_names.draw_name
+        monkeypatch.setattr(mailbox_names, 'draw_name', lambda tier: next(tier0) if tier == 0 else real(tier))
+    return use
+
+
+def take(*names):
+    with app.app_context():
+        db.session.add_all(Inbox(api_key='names-test', inbox=f'{name}@names.test') for name in names)
+        db.session.commit()
+
+
+def allocate(count):
+    with app.app_context():
+        return mailbox_names.allocate_addresses(count, 'names.test')
+
+
+def test_one_collision_stays_in_the_plain_tier(names):
+    take('calm.calm.otter')
+    names(['calm.calm.otter'] + [f'calm.calm.fox{"x" * i}' for i in range(1, 8)])
+    [address] = allocate(1)
+    assert address.startswith('calm.calm.fox')
+
+
+def test_a_mostly_taken_tier_escalates(names):
+    taken = [f'busy.busy.{"n" * i}' for i in range(1, 8)]
+    take(*taken)
+    names(taken + ['busy.busy.free'])
+    # One free name in eight: the round returns it but moves on for the rest
+    addresses = allocate(3)
+    assert 'busy.busy.free@names.test' in addresses
+    assert all(address[len('busy.busy.'):].split('@')[0][-2:].isdigit()
+               for address in addresses if address != 'busy.busy.free@names.test')
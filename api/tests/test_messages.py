@@ -0,0 +1,63 @@
+"""Ingest and the paginated message listing (tempmail_api.py)."""
+
+import pytest
+
+INGEST = {'Authorization': 'Bearer test-secret'}
+
+
+@pytest.fixture
+def mailbox(client, make_user):
+    '''An API key with two inboxes; returns (auth headers, [address, address])'''
+    _, api_key = make_user(inbox_quota=2)
+    headers = {'Authorization': f'Bearer {api_key}'}
+    response = client.post('/inboxes', json={'count': 2}, headers=headers)
+    assert response.status_code == 201
+    return headers, response.get_json()['inboxes']
+
+
+def ingest(client, recipient, count):
+    emails = [{'recipients': [recipient], 'headers': {'Subject': f'{recipient} #{i}'},
+               'sender': 'a@example.com', 'text_body': f'body {i}'} for i in range(count)]
+    response = client.post('/emails', json=emails, headers=INGEST)
+    assert response.get_json() == {'stored': count}
+
+
+def list_all(client, headers, **params):
+    '''Follows X-Next-Cursor; returns every message listed and the number of pages'''
+    messages, pages, cursor = [], 0, None
+    while True:
+        query = dict(params, **({'cursor': cursor} if cursor else {}))
+        response = client.get('/messages', query_string=query, headers=headers)
+        assert response.status_code == 200
+        messages += response.get_json()
+        pages += 1
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            return messages, pages
+
+
+def test_pages_of_a_key_are_newest_first_without_gaps(client, mailbox):
+    headers, (first, second) = mailbox
+    ingest(client, first, 7)
+    ingest(client, second, 5)
+
+    messages, pages = list_all(client, headers, limit=5, summary=1)
+    assert pages == 3
+    seqs = [message['seq'] for message in messages]
+    assert seqs == sorted(seqs, reverse=True) and len(set(seqs)) == 12
+    assert messages[0]['subject'] == f'{second} #4'
+
+
+def test_inbox_filter_lists_only_owned_inboxes(client, mailbox, make_user):
+    headers, (first, second) = mailbox
+    ingest(client, first, 3)
+    ingest(client, second, 2)
+
+    messages, _ = list_all(client, headers, inbox=second, limit=1)
+    assert [message['inbox'] for message in messages] == [second, second]
+
+    _, other_key = make_user()
+    other = {'Authorization': f'Bearer {other_key}'}
+    assert list_all(client, other, inbox=first)[0] == []
+    assert client.get(f'/message/{messages[0]["id"]}', headers=other).status_code == 404
+    assert client.get(f'/message/{messages[0]["id"]}', headers=headers).status_code == 200
@@ -0,0 +1,115 @@
+"""process_due() against a local stand-in for Blockonomics' monitor_tx (payment_monitor.py)."""
+
+import json
+import threading
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import payment_monitor
+from config import app, db
+from db_models import MonitorStatus, PaymentIntent
+
+
+class FakeBlockonomics(BaseHTTPRequestHandler):
+    # txhash -> statuses to answer with, in order; 200 once they run out
+    replies = {}
+    received = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.received.append((self.path, body['txhash']))
+        statuses = self.replies.get(body['txhash'])
+        status = statuses.pop(0) if statuses else 200
+        payload = b'{}' if status == 200 else b'{"error": "rejected"}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def blockonomics(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBlockonomics)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(payment_monitor, 'BLOCKONOMICS_URL', f'http://127.0.0.1:{server.server_port}')
+    FakeBlockonomics.replies, FakeBlockonomics.received = {}, []
+    yield FakeBlockonomics
+    server.shutdown()
+    server.server_close()
+
+
+def queue_intent(*statuses):
+    '''Queues an intent that Blockonomics answers with statuses, then 200'''
+    txhash = '0x' + uuid.uuid4().hex
+    FakeBlockonomics.replies[txhash] = list(statuses)
+    with app.app_context():
+        db.session.add(PaymentIntent(txhash=txhash, user_id='monitor-test', amount=10))
+        db.session.commit()
+    return txhash
+
+
+def intent(txhash):
+    with app.app_context():
+        return db.session.get(PaymentIntent, txhash)
+
+
+def process_due():
+    with app.app_context():
+        return payment_monitor.process_due()
+
+
+def test_accepted_intent_is_registered(blockonomics):
+    txhash = queue_intent()
+    process_due()
+    row = intent(txhash)
+    assert row.monitor_status == MonitorStatus.REGISTERED.value
+    assert row.monitor_attempts == 1 and row.monitor_error is None
+    assert ('/api/monitor_tx', txhash) in blockonomics.received
+
+
+def test_rejected_intent_fails_without_retrying(blockonomics):
+    txhash = queue_intent(400)
+    process_due()
+    process_due()
+    row = intent(txhash)
+    assert row.monitor_status == MonitorStatus.FAILED.value
+    assert row.monitor_error.startswith('HTTP 400')
+    assert blockonomics.received.count(('/api/monitor_tx', txhash)) == 1
+
+
+def test_flaky_intent_backs_off_then_registers(blockonomics):
+    txhash = queue_intent(503, 500)
+    before = datetime.utcnow()
+    process_due()
+    row = intent(txhash)
+    assert row.monitor_status == MonitorStatus.QUEUED.value
+    assert row.monitor_attempts == 1 and row.monitor_error.startswith('HTTP 503')
+    assert row.monitor_next_attempt >= before + timedelta(seconds=2)
+
+    # Not due yet: nothing is sent
+    process_due()
+    assert blockonomics.received.count(('/api/monitor_tx', txhash)) == 1
+
+    for attempts, backoff in ((2, 4), (3, None)):
+        with app.app_context():
+            db.session.query(PaymentIntent).filter_by(txhash=txhash).update(
+                {'monitor_next_attempt': datetime.utcnow()})
+            db.session.commit()
+        before = datetime.utcnow()
+        process_due()
+        row = intent(txhash)
+        assert row.monitor_attempts == attempts
+        if backoff:
+            assert row.monitor_status == MonitorStatus.QUEUED.value
+            assert row.monitor_next_attempt >= before + timedelta(seconds=backoff)
+
+    assert row.monitor_status == MonitorStatus.REGISTERED.value
+    assert row.monitor_error is None
+    assert blockonomics.received.count(('/api/monitor_tx', txhash)) == 3
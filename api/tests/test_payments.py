@@ -0,0 +1,56 @@
+"""Blockonomics callbacks credit each payment exactly once (payments.py)."""
+
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from config import app, db
+from db_models import PaymentIntent, PaymentStatus, User
+from payments import USDT_ADDRESS
+
+
+def queue_payments(user_id, amounts):
+    txids = ['0x' + uuid.uuid4().hex for _ in amounts]
+    with app.app_context():
+        db.session.add_all(PaymentIntent(txhash=txid, user_id=user_id, amount=amount)
+                           for txid, amount in zip(txids, amounts))
+        db.session.commit()
+    return txids
+
+
+def callback(client, txid):
+    return client.get('/payments/callback', query_string={
+        'txid': txid, 'value': '1000000', 'addr': USDT_ADDRESS, 'status': PaymentStatus.CONFIRMED.value})
+
+
+def test_concurrent_duplicate_callbacks_credit_once(client, make_user):
+    user_id, _ = make_user(inbox_quota=5)
+    amounts = [10 * (i + 1) for i in range(10)]
+    txids = queue_payments(user_id, amounts)
+
+    # Blockonomics retries callbacks; every txid arrives 20 times, interleaved
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        responses = list(pool.map(lambda txid: callback(app.test_client(), txid), txids * 20))
+
+    assert [response.status_code for response in responses] == [200] * len(responses)
+    messages = [response.get_json()['message'] for response in responses]
+    assert messages.count('Callback processed') == len(txids)
+    with app.app_context():
+        assert db.session.get(User, user_id).inbox_quota == 5 + sum(amounts)
+        statuses = {intent.status for intent in db.session.query(PaymentIntent).filter(
+            PaymentIntent.txhash.in_(txids))}
+        assert statuses == {PaymentStatus.CONFIRMED.value}
+
+
+def test_replayed_callbacks_credit_once(client, make_user):
+    user_id, _ = make_user(inbox_quota=0)
+    txids = queue_payments(user_id, [7, 11])
+    assert callback(client, txids[0]).status_code == 200
+
+    batch = [{'txid': txid, 'value': '1', 'addr': USDT_ADDRESS, 'status': '2'} for txid in txids * 3]
+    response = client.post('/payments/callback/replay', json=batch,
+                           headers={'Authorization': 'Bearer test-secret'})
+    assert response.status_code == 200
+    assert response.get_json()['results'] == {txids[0]: 'Payment already confirmed',
+                                              txids[1]: 'Payment already confirmed'}
+    with app.app_context():
+        assert db.session.get(User, user_id).inbox_quota == 18
@@ -0,0 +1,77 @@
+"""The hot queries are served by their indexes, on a migrated and on a new database (migration.py)."""
+
+import os
+
+import pytest
+from sqlalchemy import create_engine, inspect
+
+import migration
+from config import db
+
+# Index each query in migration.EXPLAIN_QUERIES is expected to search
+EXPECTED_INDEX = {
+    "list messages of an inbox": "ix_messages_inbox_seq",
+    "list messages of an api key": "ix_messages_api_key_seq",
+    "stream messages of an api key": "ix_messages_api_key_seq",
+    "ingest recipient lookup": "ix_inboxes_inbox",
+    "retention purge": "ix_messages_timestamp",
+    "sessions of a user": "ix_user_sessions_user_id",
+    "payment history": "ix_payment_intents_history",
+    "purchased quota of a user": "ix_payment_intents_history",
+    "expired sessions": "ix_user_sessions_expires_at",
+    "expired auth challenges": "ix_auth_challenges_expires_at",
+    "wait for new messages": "ix_messages_inbox_seq",
+    "passkey challenge lookup": "idx_passkey_challenges_challenge",
+}
+
+
+@pytest.fixture(scope='module')
+def migrated(tmp_path_factory):
+    '''A database created with the schema from before migration 1, then upgraded'''
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('migrated') / 'emptyinbox.db'}")
+    with open(os.path.join(os.path.dirname(__file__), 'baseline_schema.sql')) as f:
+        conn = engine.raw_connection()
+        conn.executescript(f.read())
+        conn.close()
+    migration.upgrade(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope='module')
+def created(tmp_path_factory):
+    '''A database created from the models, as create_db does'''
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('created') / 'emptyinbox.db'}")
+    db.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_every_hot_query_names_its_index():
+    assert set(EXPECTED_INDEX) == set(migration.EXPLAIN_QUERIES)
+
+
+@pytest.mark.parametrize('schema', ['migrated', 'created'])
+@pytest.mark.parametrize('label', sorted(migration.EXPLAIN_QUERIES))
+def test_hot_query_searches_its_index(request, schema, label):
+    with request.getfixturevalue(schema).connect() as conn:
+        plan, problems = migration.query_plan(conn, migration.EXPLAIN_QUERIES[label])
+    assert problems == [], plan
+    assert any(f'INDEX {EXPECTED_INDEX[label]} ' in step for step in plan), plan
+
+
+def test_migrations_build_the_model_schema(migrated, created):
+    def schema(engine):
+        inspector = inspect(engine)
+        return {table: (sorted(column['name'] for column in inspector.get_columns(table)),
+                        sorted((index['name'], tuple(index['column_names']))
+                               for index in inspector.get_indexes(table)))
+                for table in inspector.get_table_names() if table != 'schema_migrations'}
+    assert schema(migrated) == schema(created)
+
+
+def test_migrated_messages_keep_the_body_last(migrated, created):
+    def columns(engine):
+        return [column['name'] for column in inspect(engine).get_columns('messages')]
+    assert columns(migrated) == columns(created)
+    assert columns(migrated)[-1] == 'content'
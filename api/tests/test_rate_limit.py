@@ -0,0 +1,88 @@
+"""Sliding-window counts and Retry-After (rate_limit.py)."""
+
+import threading
+import uuid
+
+import pytest
+
+import rate_limit
+
+DAY = 86400
+
+
+def fill(key, limit, period, times):
+    '''Hits key at each of times, all of which must be allowed'''
+    for now in times:
+        assert rate_limit.hit(key, limit, period, now=now) == (True, 0)
+
+
+@pytest.mark.parametrize('limit, period, times, now', [
+    # The current window is full: its count weighs on the next window too
+    (3, DAY, [DAY * 100 + 20] * 3, DAY * 100 + 20),
+    (60, 60, [6000 + i for i in range(60)], 6059),
+    # The previous window's weight alone blocks the request
+    (3, DAY, [DAY * 100 + 20] * 3, DAY * 101 + 5),
+    # Both windows contribute
+    (10, 60, [6000] * 8 + [6065] * 2, 6066),
+])
+def test_retry_after_is_the_first_allowed_second(limit, period, times, now):
+    key = f'test:{uuid.uuid4()}'
+    fill(key, limit, period, times)
+    allowed, retry_after = rate_limit.hit(key, limit, period, now=now)
+    assert not allowed
+    if retry_after > 1:
+        assert not rate_limit.hit(key, limit, period, now=now + retry_after - 1)[0]
+    assert rate_limit.hit(key, limit, period, now=now + retry_after)[0]
+
+
+def test_full_day_window_waits_into_the_next_day():
+    key = f'test:{uuid.uuid4()}'
+    start = DAY * 100 + 20
+    fill(key, 3, DAY, [start] * 3)
+    # A third of the next day has to pass before three requests weigh less than two
+    assert rate_limit.hit(key, 3, DAY, now=start) == (False, DAY - 20 + DAY // 3)
+
+
+def test_concurrent_hits_share_one_count():
+    key = f'test:{uuid.uuid4()}'
+    results = []
+
+    def worker():
+        for _ in range(10):
+            results.append(rate_limit.hit(key, 50, 3600, now=7200)[0])
+
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 50
+
+
+def rate_limit_keys(prefix):
+    with rate_limit._lock:
+        rows = rate_limit.connect().execute('SELECT key FROM rate_limits WHERE key LIKE ?;', (prefix + '%',))
+        return {key for key, in rows}
+
+
+def test_unauthorized_ingest_does_not_spend_the_email_budget(client):
+    # The LMTP drainer's budget, spent by a caller that can't authenticate
+    environ = {'REMOTE_ADDR': '192.0.2.25'}
+    for path in ('/email', '/emails'):
+        response = client.post(path, json=[], headers={'X-Forwarded-For': '192.0.2.25'}, environ_base=environ)
+        assert response.status_code == 403
+    assert 'email:192.0.2.25' not in rate_limit_keys('email:')
+
+    response = client.post('/emails', json=[], headers={'Authorization': 'Bearer test-secret'},
+                           environ_base=environ)
+    assert response.status_code == 201
+    assert 'email:192.0.2.25' in rate_limit_keys('email:')
+
+
+def test_client_ip_is_the_address_nginx_appended(client):
+    # A client-sent X-Forwarded-For is followed by the address nginx saw
+    headers = {'X-Forwarded-For': '6.6.6.6, 203.0.113.9'}
+    for _ in range(3):
+        client.post('/auth/register', json={}, headers=headers, environ_base={'REMOTE_ADDR': '127.0.0.1'})
+    assert 'register:203.0.113.9' in rate_limit_keys('register:')
+    assert 'register:6.6.6.6' not in rate_limit_keys('register:')
@@ -0,0 +1,37 @@
+"""Expiry of short-lived rows.
+
+Every table listed in TTL_TABLES has an indexed expires_at column. Read paths filter on
+it, so an expired row is treated as absent the moment it expires; purge_expired() then
+deletes such rows in bounded batches, counting them from each DELETE's rowcount.
+"""
+
+import time
+from datetime import datetime
+from sqlalchemy import select
+from config import db
+from db_models import AuthChallenge, PasskeyChallenge, UserSession
+from constants import TTL_BATCH_SIZE, TTL_BATCH_PAUSE
+
+# (label, model, primary key column)
+TTL_TABLES = [
+    ('auth challenges', AuthChallenge, AuthChallenge.id),
+    ('passkey challenges', PasskeyChallenge, PasskeyChallenge.challenge_id),
+    ('expired sessions', UserSession, UserSession.token),
+]
+
+def purge_table(model, key, now, batch_size=TTL_BATCH_SIZE):
+    """Deletes the rows of model that expired before now, batch_size at a time."""
+    expired = select(key).where(model.expires_at < now).limit(batch_size)
+    deleted = 0
+    while True:
+        result = db.session.execute(db.delete(model).where(key.in_(expired)))
+        db.session.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+        time.sleep(TTL_BATCH_PAUSE)
+
+def purge_expired(now=None):
+    """Returns {label: rows deleted} for every TTL table."""
+    now = now or datetime.utcnow()
+    return {label: purge_table(model, key, now) for label, model, key in TTL_TABLES}
@@ -7,6 +7,10 @@ export interface MessageSummary {
     html_body: string;
     sender: string;
     timestamp: number;
+    seq: number;
+    snippet?: string;
+    size?: number;
+    has_html?: boolean;
 }
 export interface MessageFull {
     recipients: string[];
@@ -15,6 +19,13 @@ export interface MessageFull {
     html_body: string;
     sender: string;
 }
+export interface ListMessagesOptions {
+    inbox?: string;
+    since?: number;
+    limit?: number;
+    cursor?: string;
+    summary?: boolean;
+}
 export interface Inbox {
     inbox: string;
     created_at: string;
@@ -26,10 +37,17 @@ export declare function registerAgent(username: string): Promise<{
 }>;
 export declare class EmptyInboxClient {
     private headers;
+    private listCache;
     constructor(apiKey: string);
     createInbox(): Promise<string>;
+    private getList;
     listInboxes(): Promise<Inbox[]>;
-    listMessages(): Promise<MessageSummary[]>;
+    listMessages(options?: ListMessagesOptions): Promise<MessageSummary[]>;
+    waitForMessages(inbox: string, options?: {
+        after?: string;
+        afterSeq?: number;
+        timeout?: number;
+    }): Promise<MessageSummary[]>;
     getMessage(msgid: string): Promise<MessageFull>;
     getQuota(): Promise<{
         inbox_quota: number;
@@ -11,8 +11,11 @@ export async function registerAgent(username) {
     }
     return res.json();
 }
+// Responses kept for conditional GETs; enough for the lists one agent polls
+const LIST_CACHE_SIZE = 50;
 export class EmptyInboxClient {
     headers;
+    listCache = new Map();
     constructor(apiKey) {
         this.headers = {
             Authorization: `Bearer ${apiKey}`,
@@ -28,16 +31,49 @@ export class EmptyInboxClient {
             throw new Error(`createInbox failed: ${res.status} ${await res.text()}`);
         return res.text();
     }
-    async listInboxes() {
-        const res = await fetch(`${BASE_URL}/inboxes`, { headers: this.headers });
+    // GETs a list endpoint, revalidating the last response with its ETag; an unchanged list is a bodyless 304
+    async getList(url, name) {
+        const cached = this.listCache.get(url);
+        const headers = cached ? { ...this.headers, "If-None-Match": cached.etag } : this.headers;
+        const res = await fetch(url, { headers });
+        if (res.status === 304 && cached)
+            return cached.body;
         if (!res.ok)
-            throw new Error(`listInboxes failed: ${res.status} ${await res.text()}`);
-        return res.json();
+            throw new Error(`${name} failed: ${res.status} ${await res.text()}`);
+        const body = await res.json();
+        const etag = res.headers.get("ETag");
+        this.listCache.delete(url);
+        if (etag) {
+            this.listCache.set(url, { etag, body });
+            if (this.listCache.size > LIST_CACHE_SIZE)
+                this.listCache.delete(this.listCache.keys().next().value);
+        }
+        return body;
+    }
+    async listInboxes() {
+        return this.getList(`${BASE_URL}/inboxes`, "listInboxes");
+    }
+    async listMessages(options = {}) {
+        const params = new URLSearchParams();
+        for (const [key, value] of Object.entries(options)) {
+            if (value !== undefined)
+                params.set(key, typeof value === "boolean" ? (value ? "1" : "0") : String(value));
+        }
+        return this.getList(`${BASE_URL}/messages?${params}`, "listMessages");
     }
-    async listMessages() {
-        const res = await fetch(`${BASE_URL}/messages`, { headers: this.headers });
+    async waitForMessages(inbox, options = {}) {
+        const params = new URLSearchParams();
+        if (options.after)
+            params.set("after", options.after);
+        if (options.afterSeq !== undefined)
+            params.set("after_seq", String(options.afterSeq));
+        if (options.timeout !== undefined)
+            params.set("timeout", String(options.timeout));
+        const res = await fetch(`${BASE_URL}/inbox/${encodeURIComponent(inbox)}/wait?${params}`, { headers: this.headers });
         if (!res.ok)
-            throw new Error(`listMessages failed: ${res.status} ${await res.text()}`);
+            throw new Error(`waitForMessages failed: ${res.status} ${await res.text()}`);
+        if (res.status === 204)
+            return [];
         return res.json();
     }
     async getMessage(msgid) {
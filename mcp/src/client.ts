@@ -8,6 +8,10 @@ export interface MessageSummary {
   html_body: string;
   sender: string;
   timestamp: number;
+  seq: number;
+  snippet?: string;
+  size?: number;
+  has_html?: boolean;
 }
 
 export interface MessageFull {
@@ -18,6 +22,14 @@ export interface MessageFull {
   sender: string;
 }
 
+export interface ListMessagesOptions {
+  inbox?: string;
+  since?: number;
+  limit?: number;
+  cursor?: string;
+  summary?: boolean;
+}
+
 export interface Inbox {
   inbox: string;
   created_at: string;
@@ -36,8 +48,12 @@ export async function registerAgent(username: string): Promise<{ api_key: string
   return res.json();
 }
 
+// Responses kept for conditional GETs; enough for the lists one agent polls
+const LIST_CACHE_SIZE = 50;
+
 export class EmptyInboxClient {
   private headers: Record<string, string>;
+  private listCache = new Map<string, { etag: string; body: unknown }>();
 
   constructor(apiKey: string) {
     this.headers = {
@@ -55,15 +71,43 @@ export class EmptyInboxClient {
     return res.text();
   }
 
+  // GETs a list endpoint, revalidating the last response with its ETag; an unchanged list is a bodyless 304
+  private async getList<T>(url: string, name: string): Promise<T> {
+    const cached = this.listCache.get(url);
+    const headers = cached ? { ...this.headers, "If-None-Match": cached.etag } : this.headers;
+    const res = await fetch(url, { headers });
+    if (res.status === 304 && cached) return cached.body as T;
+    if (!res.ok) throw new Error(`${name} failed: ${res.status} ${await res.text()}`);
+    const body = await res.json();
+    const etag = res.headers.get("ETag");
+    this.listCache.delete(url);
+    if (etag) {
+      this.listCache.set(url, { etag, body });
+      if (this.listCache.size > LIST_CACHE_SIZE) this.listCache.delete(this.listCache.keys().next().value!);
+    }
+    return body;
+  }
+
   async listInboxes(): Promise<Inbox[]> {
-    const res = await fetch(`${BASE_URL}/inboxes`, { headers: this.headers });
-    if (!res.ok) throw new Error(`listInboxes failed: ${res.status} ${await res.text()}`);
-    return res.json();
+    return this.getList<Inbox[]>(`${BASE_URL}/inboxes`, "listInboxes");
+  }
+
+  async listMessages(options: ListMessagesOptions = {}): Promise<MessageSummary[]> {
+    const params = new URLSearchParams();
+    for (const [key, value] of Object.entries(options)) {
+      if (value !== undefined) params.set(key, typeof value === "boolean" ? (value ? "1" : "0") : String(value));
+    }
+    return this.getList<MessageSummary[]>(`${BASE_URL}/messages?${params}`, "listMessages");
   }
 
-  async listMessages(): Promise<MessageSummary[]> {
-    const res = await fetch(`${BASE_URL}/messages`, { headers: this.headers });
-    if (!res.ok) throw new Error(`listMessages failed: ${res.status} ${await res.text()}`);
+  async waitForMessages(inbox: string, options: { after?: string; afterSeq?: number; timeout?: number } = {}): Promise<MessageSummary[]> {
+    const params = new URLSearchParams();
+    if (options.after) params.set("after", options.after);
+    if (options.afterSeq !== undefined) params.set("after_seq", String(options.afterSeq));
+    if (options.timeout !== undefined) params.set("timeout", String(options.timeout));
+    const res = await fetch(`${BASE_URL}/inbox/${encodeURIComponent(inbox)}/wait?${params}`, { headers: this.headers });
+    if (!res.ok) throw new Error(`waitForMessages failed: ${res.status} ${await res.text()}`);
+    if (res.status === 204) return [];
     return res.json();
   }
 
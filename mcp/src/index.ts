@@ -108,15 +108,14 @@ server.registerTool("list_messages", {
     limit: z.number().default(10).describe("Max messages to return (default: 10)"),
   },
 }, async ({ inbox, limit }) => {
-  const messages = await client.listMessages();
-  const filtered = inbox ? messages.filter((m) => m.inbox === inbox) : messages;
-  const compact = filtered.slice(0, limit).map(({ id, inbox, subject, sender, timestamp, text_body }) => ({
+  const messages = await client.listMessages({ inbox, limit, summary: true });
+  const compact = messages.map(({ id, inbox, subject, sender, timestamp, snippet }) => ({
     id,
     inbox,
     subject,
     sender,
     timestamp,
-    text_body: text_body?.slice(0, 500) ?? "",
+    text_body: snippet ?? "",
   }));
   return { content: [{ type: "text" as const, text: JSON.stringify(compact, null, 2) }] };
 });
@@ -132,23 +131,23 @@ server.registerTool("get_message", {
 });
 
 server.registerTool("wait_for_message", {
-  description: "Poll an inbox until a new message arrives. Use after triggering an email verification, OTP, or signup confirmation. Returns the message as soon as it lands, or a timeout result.",
+  description: "Wait for a new message to arrive in an inbox. Use after triggering an email verification, OTP, or signup confirmation. Returns the message as soon as it lands, or a timeout result.",
   inputSchema: {
     inbox: z.string().describe("Inbox email address to watch"),
     timeout_seconds: z.number().default(120).describe("Seconds to wait before giving up (default: 120)"),
-    poll_interval_seconds: z.number().default(5).describe("Seconds between checks (default: 5)"),
   },
-}, async ({ inbox, timeout_seconds, poll_interval_seconds }) => {
+}, async ({ inbox, timeout_seconds }) => {
   const deadline = Date.now() + timeout_seconds * 1000;
-  const initial = await client.listMessages();
-  const initialCount = initial.filter((m) => m.inbox === inbox).length;
+  const [latest] = await client.listMessages({ inbox, limit: 1, summary: true });
+  // Anything after the newest listed message is new; in an empty inbox, every message is
+  const afterSeq = latest?.seq ?? 0;
 
   while (Date.now() < deadline) {
-    await new Promise((r) => setTimeout(r, poll_interval_seconds * 1000));
-    const messages = await client.listMessages();
-    const inboxMessages = messages.filter((m) => m.inbox === inbox);
-    if (inboxMessages.length > initialCount) {
-      return { content: [{ type: "text" as const, text: JSON.stringify(inboxMessages[0], null, 2) }] };
+    // The server parks the request until mail lands (or its own timeout cap passes)
+    const timeout = Math.ceil((deadline - Date.now()) / 1000);
+    const [newest] = await client.waitForMessages(inbox, { afterSeq, timeout });
+    if (newest) {
+      return { content: [{ type: "text" as const, text: JSON.stringify(newest, null, 2) }] };
     }
   }
 
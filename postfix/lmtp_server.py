@@ -0,0 +1,193 @@
+#! /usr/bin/python3
+"""Long-running LMTP delivery service for Postfix.
+
+Replaces the per-email `process_email.py` pipe: mail is parsed in-process,
+written to the durable spool (spool.py) and acknowledged. A drainer thread
+forwards the spool to the API in batches over a pooled keep-alive connection,
+so a burst of messages doesn't pay interpreter start-up and a TLS handshake
+each, and an API outage only delays delivery.
+
+Postfix side (see setup_postfix.sh):
+    transport_maps:  DOMAIN lmtp:inet:127.0.0.1:2424
+"""
+
+import logging
+import os
+import re
+import socket
+import socketserver
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from mail_parser import MailFeed, build_payload
+import spool
+
+LMTP_LISTEN = os.getenv('LMTP_LISTEN', '127.0.0.1:2424')  # host:port or a unix socket path
+INGEST_URL = os.getenv('INGEST_URL', 'http://127.0.0.1:5000/emails')
+MAX_MESSAGE_SIZE = 10240000  # matches message_size_limit in setup_postfix.sh
+
+logger = logging.getLogger('lmtp')
+
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=32))
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=32))
+session.headers.update({
+    'User-Agent': 'tempmail/service',
+    'Authorization': f"Bearer {os.getenv('SECRET')}",
+})
+
+
+def parse_address(arg):
+    """Extract the address from `FROM:<addr> PARAMS` / `TO:<addr> PARAMS`."""
+    start, end = arg.find('<'), arg.find('>')
+    if start == -1 or end == -1:
+        return arg.split(':', 1)[-1].strip(), ''
+    return arg[start + 1:end], arg[end + 1:]
+
+
+def xtext_decode(value):
+    return re.sub(r'\+([0-9A-Fa-f]{2})', lambda m: chr(int(m.group(1), 16)), value)
+
+
+def original_recipient(address, params):
+    """Postfix rewrites every recipient to root@DOMAIN via virtual_alias_maps; the
+    address the sender used comes back in the DSN ORCPT parameter."""
+    for param in params.split():
+        key, _, value = param.partition('=')
+        if key.upper() == 'ORCPT' and value.lower().startswith('rfc822;'):
+            return xtext_decode(value[len('rfc822;'):])
+    return address
+
+
+spool_ready = threading.Event()
+
+
+def deliver(feed, sender, recipients):
+    spool.enqueue(build_payload(feed.close(), sender, recipients, feed.truncated))
+    spool_ready.set()
+
+
+def run_drainer():
+    """Forward the spool to the API, waking on new mail or when a retry falls due."""
+    while True:
+        try:
+            if not spool.drain(session, INGEST_URL):
+                logger.warning('Spool backlog: %s', spool.stats())
+            due = spool.next_due()
+        except Exception:
+            logger.exception('Spool drain failed')
+            due = None
+        timeout = max(0.0, due - time.time()) if due else None
+        spool_ready.wait(timeout if timeout is None else min(timeout, spool.MAX_BACKOFF))
+        spool_ready.clear()
+
+
+class LMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def reset(self):
+        self.sender = None
+        self.recipients = []
+
+    def handle(self):
+        self.reset()
+        self.reply(f'220 {socket.getfqdn()} LMTP ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, arg = line.decode('utf-8', 'replace').rstrip('\r\n').partition(' ')
+            command = command.upper()
+            if command == 'LHLO':
+                self.reply(f'250-{socket.getfqdn()}')
+                self.reply('250-8BITMIME')
+                self.reply('250-DSN')
+                self.reply('250-PIPELINING')
+                self.reply(f'250 SIZE {MAX_MESSAGE_SIZE}')
+            elif command == 'MAIL':
+                self.reset()
+                self.sender, _ = parse_address(arg)
+                self.reply('250 2.1.0 OK')
+            elif command == 'RCPT':
+                if self.sender is None:
+                    self.reply('503 5.5.1 MAIL first')
+                    continue
+                address, params = parse_address(arg)
+                self.recipients.append(original_recipient(address, params))
+                self.reply('250 2.1.5 OK')
+            elif command == 'DATA':
+                if not self.recipients:
+                    self.reply('503 5.5.1 RCPT first')
+                    continue
+                self.reply('354 Start mail input; end with <CRLF>.<CRLF>')
+                self.handle_data()
+            elif command == 'RSET':
+                self.reset()
+                self.reply('250 2.0.0 OK')
+            elif command == 'NOOP':
+                self.reply('250 2.0.0 OK')
+            elif command == 'QUIT':
+                self.reply('221 2.0.0 Bye')
+                return
+            else:
+                self.reply('502 5.5.2 Command not implemented')
+
+    def handle_data(self):
+        # Parse as the message streams in rather than buffering it whole
+        feed, size = MailFeed(), 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if line in (b'.\r\n', b'.\n'):
+                break
+            if line.startswith(b'.'):
+                line = line[1:]
+            size += len(line)
+            if size <= MAX_MESSAGE_SIZE:
+                feed.feed(line)
+
+        # LMTP answers once per accepted recipient after DATA
+        if size > MAX_MESSAGE_SIZE:
+            status = '552 5.3.4 Message too big'
+        else:
+            try:
+                deliver(feed, self.sender, self.recipients)
+                status = '250 2.0.0 Spooled'
+            except Exception:
+                logger.exception('Spooling failed')
+                status = '451 4.3.0 Temporary failure, try again later'
+        for _ in self.recipients:
+            self.reply(status)
+        self.reset()
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    if LMTP_LISTEN.startswith('/'):
+        if os.path.exists(LMTP_LISTEN):
+            os.unlink(LMTP_LISTEN)
+        server = ThreadingUnixServer(LMTP_LISTEN, LMTPHandler)
+        os.chmod(LMTP_LISTEN, 0o666)
+    else:
+        host, port = LMTP_LISTEN.rsplit(':', 1)
+        server = ThreadingTCPServer((host, int(port)), LMTPHandler)
+    threading.Thread(target=run_drainer, name='spool-drainer', daemon=True).start()
+    logger.info('Listening for LMTP on %s, forwarding to %s', LMTP_LISTEN, INGEST_URL)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Bounded MIME parsing for inbound mail.
+
+The message is fed to a BytesFeedParser as it arrives, and each part is touched
+once: the first text/plain and text/html bodies are decoded up to BODY_CAP
+characters, everything else is recorded as attachment metadata without being
+decoded. Memory and CPU per email stay bounded whatever the sender's message size.
+"""
+
+import base64
+import binascii
+import os
+import quopri
+from email import policy
+from email.feedparser import BytesFeedParser
+
+# Stop feeding the parser past this many bytes; the rest of the message is dropped
+MAX_PARSE_BYTES = int(os.getenv('MAX_PARSE_BYTES', 4 << 20))
+# Text and HTML bodies are truncated to this many characters
+BODY_CAP = int(os.getenv('BODY_CAP', 512 << 10))
+
+
+class MailFeed:
+    """Incrementally parses a raw message, ignoring input past MAX_PARSE_BYTES."""
+
+    def __init__(self, max_bytes=MAX_PARSE_BYTES):
+        self.parser = BytesFeedParser(policy=policy.SMTP)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.truncated = False
+
+    def feed(self, data):
+        remaining = self.max_bytes - self.size
+        self.size += len(data)
+        if remaining <= 0:
+            self.truncated = True
+            return
+        if len(data) > remaining:
+            self.truncated = True
+            data = data[:remaining]
+        self.parser.feed(data)
+
+    def close(self):
+        return self.parser.close()
+
+
+def parse_file(fp, chunk_size=64 << 10):
+    feed = MailFeed()
+    for chunk in iter(lambda: fp.read(chunk_size), b''):
+        feed.feed(chunk)
+    return feed
+
+
+def encoded_payload(part):
+    payload = part.get_payload()
+    return payload if isinstance(payload, str) else ''
+
+
+def decode_text(part, cap=None):
+    """Decode at most `cap` characters of a text part, slicing before decoding."""
+    cap = cap or BODY_CAP
+    raw = encoded_payload(part)
+    cte = part.get('Content-Transfer-Encoding', '7bit').strip().lower()
+    try:
+        if cte == 'base64':
+            compact = ''.join(raw.split())
+            data = base64.b64decode(compact[:(cap * 4 // 3 + 3) // 4 * 4])
+        elif cte == 'quoted-printable':
+            data = quopri.decodestring(raw[:cap * 3].encode('utf-8', 'surrogateescape'))
+        else:
+            text = raw[:cap * 4]
+            try:
+                data = text.encode('ascii', 'surrogateescape')
+            except UnicodeEncodeError:
+                # The parser already decoded this 8bit body to characters
+                return text[:cap]
+    except (binascii.Error, ValueError):
+        data = b''
+    charset = part.get_content_charset() or 'utf-8'
+    try:
+        text = data.decode(charset, 'replace')
+    except LookupError:
+        text = data.decode('utf-8', 'replace')
+    return text[:cap]
+
+
+def attachment_size(part):
+    """Approximate decoded size from the encoded payload, without decoding it."""
+    raw = encoded_payload(part)
+    if part.get('Content-Transfer-Encoding', '').strip().lower() == 'base64':
+        return len(''.join(raw.split())) * 3 // 4
+    return len(raw)
+
+
+def build_payload(email, sender, recipients, truncated=False):
+    data = {
+        'sender': sender,
+        'recipients': recipients,
+        'headers': { k:v  for k,v in email.items()},
+        }
+
+    attachments = []
+    for part in email.walk():
+        if part.is_multipart():
+            continue
+        content_type = part.get_content_type()
+        if not part.is_attachment() and content_type in ('text/plain', 'text/html'):
+            key = 'text_body' if content_type == 'text/plain' else 'html_body'
+            if key not in data:
+                data[key] = decode_text(part)
+                continue
+        attachments.append({
+            'filename': part.get_filename(),
+            'content_type': content_type,
+            'size': attachment_size(part),
+        })
+
+    if attachments:
+        data['attachments'] = attachments
+    if truncated:
+        data['truncated'] = True
+    return data
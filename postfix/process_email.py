@@ -5,29 +5,34 @@ import sys
 import json
 import requests
 import base64
-from email.parser import Parser
-from email import policy
+import spool
+from mail_parser import build_payload, parse_file
 
-email = Parser(policy=policy.SMTP).parse(sys.stdin)
+EX_TEMPFAIL = 75
 
 
-secret = os.getenv('SECRET')
-domain = os.getenv('DOMAIN')
-headers = {
-    'User-Agent': 'tempmail/service',
-    'Authorization': f'Bearer {secret}'
-}
-
-data = {
-    'sender':sys.argv[1],
-    'recipients' : sys.argv[2:],
-    'headers': { k:v  for k,v in email.items()},
+def main():
+    feed = parse_file(sys.stdin.buffer)
 
+    secret = os.getenv('SECRET')
+    domain = os.getenv('DOMAIN')
+    headers = {
+        'User-Agent': 'tempmail/service',
+        'Authorization': f'Bearer {secret}'
     }
-if email.get_body(('plain',)):
-    data['text_body'] = email.get_body(('plain',)).get_content()
 
-if email.get_body(('html',)):
-    data['html_body'] = email.get_body(('html',)).get_content()
+    data = build_payload(feed.close(), sys.argv[1], sys.argv[2:], feed.truncated)
+    try:
+        spool.enqueue(data)
+    except Exception:
+        # Not spooled: have Postfix keep the message and retry later
+        sys.exit(EX_TEMPFAIL)
+
+    # Best effort; anything left behind is forwarded by the next run or lmtp_server.py
+    with requests.Session() as session:
+        session.headers.update(headers)
+        spool.drain(session, f'https://{domain}/api/emails')
+
 
-requests.post(f'https://{domain}/api/email', json=data, headers=headers)
+if __name__ == '__main__':
+    main()
@@ -76,11 +76,17 @@ echo "@$DOMAIN root@$DOMAIN" > /etc/postfix/virtual_aliases
 postmap /etc/postfix/virtual_aliases
 postconf -e "virtual_alias_maps=hash:/etc/postfix/virtual_aliases"
 
-# Configure transport
-echo "$DOMAIN tempmail" > /etc/postfix/transport
+# Configure transport: deliver over LMTP to the long-running lmtp_server.py.
+# Use "$DOMAIN tempmail" instead to fall back to spawning process_email.py per message.
+echo "$DOMAIN lmtp:inet:127.0.0.1:2424" > /etc/postfix/transport
 postmap /etc/postfix/transport
 postconf -e "transport_maps=hash:/etc/postfix/transport"
 
+# Start the LMTP delivery service
+sed "s#/home/ubuntu/emptyinbox-me#$(dirname "$CURRENT_DIR")#g" "${CURRENT_DIR}/emptyinbox_lmtp.service" > /etc/systemd/system/emptyinbox_lmtp.service
+systemctl daemon-reload
+systemctl enable --now emptyinbox_lmtp
+
 echo
 echo 'postfix configured. Starting up'
 echo
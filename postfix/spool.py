@@ -0,0 +1,202 @@
+#! /usr/bin/python3
+"""Durable on-disk spool for inbound mail.
+
+Delivery writes each parsed email here first and acknowledges Postfix straight
+away; a drainer forwards spooled mail to the API's batch endpoint and backs off
+while the API is slow or down. Nothing is lost if gunicorn is saturated.
+
+    python3 spool.py stats             # depth, oldest entry age and dead letters as JSON
+    python3 spool.py drain             # forward everything that is due, then exit
+    python3 spool.py requeue [id ...]  # send dead letters (all, or the given ids) again
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from contextlib import closing
+
+SPOOL_PATH = os.getenv('SPOOL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool.db'))
+BATCH_SIZE = 50
+LEASE_SECONDS = 60     # a claimed batch is retried after this if its drainer dies
+MAX_BACKOFF = 300
+# Transient failures (connection errors, timeouts, 5xx, 429) are retried, each entry on its
+# own schedule, until it is this old, like Postfix's maximal_queue_lifetime; only then is it
+# parked as a dead letter
+MAX_AGE = 5 * 86400
+
+logger = logging.getLogger('spool')
+
+
+def connect():
+    conn = sqlite3.connect(SPOOL_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=FULL;")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS spool (
+            id           INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload      TEXT NOT NULL,
+            created_at   REAL NOT NULL,
+            attempts     INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL,
+            dead         INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_spool_due ON spool(dead, next_attempt);")
+    return conn
+
+
+def enqueue(payload):
+    now = time.time()
+    with closing(connect()) as conn:
+        conn.execute(
+            "INSERT INTO spool (payload, created_at, next_attempt) VALUES (?, ?, ?);",
+            (json.dumps(payload), now, now),
+        )
+
+
+def claim(conn, batch_size):
+    """Lease up to batch_size due entries so concurrent drainers don't double-send."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        rows = conn.execute(
+            "SELECT id, payload, attempts, created_at FROM spool WHERE dead = 0 AND next_attempt <= ? "
+            "ORDER BY id LIMIT ?;",
+            (now, batch_size),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE spool SET next_attempt = ? WHERE id = ?;",
+            [(now + LEASE_SECONDS, row[0]) for row in rows],
+        )
+        conn.execute("COMMIT;")
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+    return rows
+
+
+def is_permanent(status):
+    """A 4xx other than timeout or rate limiting means the API will never accept the payload."""
+    return status is not None and 400 <= status < 500 and status not in (408, 429)
+
+
+def is_outage(status):
+    """No answer, rate limiting or 503 means the API is unavailable, whatever was sent."""
+    return status is None or status in (429, 503)
+
+
+def forward(session, url, rows, timeout):
+    """POST rows to the API. Returns None on success, else (status, error); status is None without a response."""
+    try:
+        response = session.post(url, json=[json.loads(row[1]) for row in rows], timeout=timeout)
+    except Exception as e:
+        return None, repr(e)
+    if response.ok:
+        return None
+    return response.status_code, f'HTTP {response.status_code}: {response.text[:200]}'
+
+
+def drain_once(session, url, batch_size=BATCH_SIZE, timeout=30):
+    """Forward one batch. Returns the number of entries settled, or None if the API failed."""
+    with closing(connect()) as conn:
+        rows = claim(conn, batch_size)
+        if not rows:
+            return 0
+        failure = forward(session, url, rows, timeout)
+        failures = {row[0]: failure for row in rows} if failure else {}
+        if failure and len(rows) > 1 and not is_outage(failure[0]):
+            # One email was rejected or made the API fail; send them one by one so only
+            # the bad ones are parked or backed off, and the rest are not held up with them
+            failures = {}
+            for index, row in enumerate(rows):
+                failure = forward(session, url, [row], timeout)
+                if failure and is_outage(failure[0]):
+                    # The API went away mid-split; what is left backs off together
+                    failures.update((rest[0], failure) for rest in rows[index:])
+                    break
+                if failure:
+                    failures[row[0]] = failure
+
+        conn.executemany("DELETE FROM spool WHERE id = ?;", [(row[0],) for row in rows if row[0] not in failures])
+        now = time.time()
+        for row_id, _, attempts, created_at in rows:
+            if row_id not in failures:
+                continue
+            status, error = failures[row_id]
+            if is_permanent(status):
+                logger.error('Spooled email %d rejected, parked as a dead letter: %s', row_id, error)
+                conn.execute("UPDATE spool SET attempts = attempts + 1, dead = 1 WHERE id = ?;", (row_id,))
+                continue
+            expired = now - created_at >= MAX_AGE
+            if expired:
+                logger.error('Spooled email %d still failing after %d attempts, parked as a dead letter: %s',
+                             row_id, attempts + 1, error)
+            else:
+                logger.warning('Forwarding spooled email %d failed, will retry: %s', row_id, error)
+            conn.execute(
+                "UPDATE spool SET attempts = ?, next_attempt = ?, dead = ? WHERE id = ?;",
+                (attempts + 1, now + min(MAX_BACKOFF, 2 ** attempts), int(expired), row_id),
+            )
+
+        # Nothing got through and some of it is due again later: the API itself is failing
+        if len(failures) == len(rows) and not all(is_permanent(status) for status, _ in failures.values()):
+            return None
+        return len(rows)
+
+
+def requeue(ids=None):
+    """Moves dead letters (all, or those in ids) back into the queue with a fresh lifetime."""
+    now = time.time()
+    query = "UPDATE spool SET dead = 0, attempts = 0, created_at = ?, next_attempt = ? WHERE dead = 1"
+    params = [now, now]
+    if ids:
+        query += f" AND id IN ({', '.join('?' * len(ids))})"
+        params += ids
+    with closing(connect()) as conn:
+        return conn.execute(query + ";", params).rowcount
+
+
+def drain(session, url):
+    """Forward everything that is currently due. Returns False if the API failed."""
+    while True:
+        delivered = drain_once(session, url)
+        if delivered is None:
+            return False
+        if delivered == 0:
+            return True
+
+
+def next_due():
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT MIN(next_attempt) FROM spool WHERE dead = 0;").fetchone()
+    return row[0]
+
+
+def stats():
+    now = time.time()
+    with closing(connect()) as conn:
+        depth, oldest, retrying = conn.execute(
+            "SELECT COUNT(*), MIN(created_at), SUM(attempts > 0) FROM spool WHERE dead = 0;"
+        ).fetchone()
+        dead = conn.execute("SELECT COUNT(*) FROM spool WHERE dead = 1;").fetchone()[0]
+    return {
+        'depth': depth,
+        'retrying': retrying or 0,
+        'oldest_age_seconds': round(now - oldest, 1) if oldest else 0,
+        'dead': dead,
+    }
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    if command == 'drain':
+        from lmtp_server import session, INGEST_URL
+        logging.basicConfig(level=logging.INFO)
+        sys.exit(0 if drain(session, INGEST_URL) else 1)
+    if command == 'requeue':
+        print(json.dumps({'requeued': requeue([int(arg) for arg in sys.argv[2:]])}))
+        sys.exit(0)
+    print(json.dumps(stats()))
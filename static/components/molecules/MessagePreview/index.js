@@ -8,6 +8,7 @@ import {
   cleanHtmlContent,
   sanitizeHtmlContent,
 } from "../../../utils/domHelpers.js";
+import { fetchMessage } from "../../../services/apiService.js";
 
 export function createMessagePreview(message) {
   const container = createElement("div", "message-preview");
@@ -22,15 +23,19 @@ export function createMessagePreview(message) {
     message.sender ||
     "Unknown";
 
+  // Listings carry a plain-text snippet; the full body is fetched on first expand
+  const hasBody = "html_body" in message || "text_body" in message;
+  const textBody = hasBody ? message.text_body : message.snippet;
+
   // Get content info
   const extractedContent = extractActivationCode(
     message.html_body,
-    message.text_body,
+    textBody,
     message.subject
   );
   const contentType = getContentType(
     message.html_body,
-    message.text_body,
+    textBody,
     message.subject
   );
   const timeAgo = formatTimeAgo(message.timestamp || Date.now() / 1000);
@@ -39,7 +44,7 @@ export function createMessagePreview(message) {
   // Create content section
   const contentSection = extractedContent
     ? createActivationSection(extractedContent, contentType)
-    : createContentPreview(message.html_body, message.text_body);
+    : createContentPreview(message.html_body, textBody);
 
   container.innerHTML = `
     <div class="message-content">
@@ -79,11 +84,7 @@ export function createMessagePreview(message) {
           <div class="full-message-section">
             <h4>Full Message Content:</h4>
             <div class="full-message-body isolated-content">
-              ${
-                sanitizeHtmlContent(message.html_body) ||
-                message.text_body ||
-                "No content available"
-              }
+              ${hasBody ? renderBody(message) : '<div class="loading-text">Loading message...</div>'}
             </div>
           </div>
         </div>
@@ -101,11 +102,33 @@ export function createMessagePreview(message) {
       return; // Don't toggle if clicking interactive elements
     }
     toggleMessageContent(messageId);
+    if (!hasBody) loadBody(container, message.id);
   });
 
   return container;
 }
 
+function renderBody(message) {
+  return (
+    sanitizeHtmlContent(message.html_body) ||
+    message.text_body ||
+    "No content available"
+  );
+}
+
+// Fills in the full message the first time a summary card is expanded
+async function loadBody(container, id) {
+  if (container.dataset.bodyLoaded) return;
+  container.dataset.bodyLoaded = "true";
+  const body = container.querySelector(".full-message-body");
+  try {
+    body.innerHTML = renderBody(await fetchMessage(id));
+  } catch (error) {
+    delete container.dataset.bodyLoaded;
+    body.innerHTML = '<div class="error-text">Unable to load message</div>';
+  }
+}
+
 // Helper functions
 function createActivationSection(content, contentType) {
   const isUrl = content.startsWith("http") || content.startsWith("/");
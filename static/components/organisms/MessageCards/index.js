@@ -1,21 +1,27 @@
 import { createElement } from "../../../utils/domHelpers.js";
 import { createMessagePreview } from "../../molecules/MessagePreview/index.js";
-import { fetchMessages } from "../../../services/apiService.js";
+import {
+  fetchMessages,
+  fetchMessagesAfter,
+  subscribeToMessages,
+} from "../../../services/apiService.js";
 import { ROUTES } from "../../../utils/constants.js";
 
 export function createMessageCards() {
   const container = createElement("div", "messages-container");
   container.id = "messages-container";
 
-  // Load all messages
+  // Load the newest page, then add only what the server pushes after it
   setTimeout(async () => {
-    await loadAllMessages(container);
+    const state = { newestSeq: 0, pending: false, refreshing: null };
+    await loadFirstPage(container, state);
+    subscribeToMessages(() => loadNewMessages(container, state));
   }, 100);
 
   return container;
 }
 
-async function loadAllMessages(container) {
+async function loadFirstPage(container, state) {
   try {
     container.innerHTML = `
       <div class="loading-state">
@@ -29,9 +35,9 @@ async function loadAllMessages(container) {
       </div>
     `;
 
-    const messages = await fetchMessages();
-
-    displayAllMessages(container, messages || []);
+    const page = await fetchMessages();
+    state.newestSeq = page.messages[0]?.seq ?? 0;
+    await displayAllMessages(container, page);
   } catch (error) {
     container.innerHTML = `
       <div class="error-state">
@@ -45,11 +51,59 @@ async function loadAllMessages(container) {
   }
 }
 
-function displayAllMessages(container, messages) {
+// Events arrive in bursts; one request at a time fetches everything newer than the top card
+function loadNewMessages(container, state) {
+  state.pending = true;
+  if (state.refreshing) return;
+  state.refreshing = (async () => {
+    while (state.pending) {
+      state.pending = false;
+      try {
+        const messages = await fetchMessagesAfter(state.newestSeq);
+        if (messages.length === 0) continue;
+        state.newestSeq = messages[0].seq;
+        container.querySelector(".no-messages-state")?.remove();
+        container.prepend(...messages.map(createMessageCard));
+      } catch (error) {
+        // The next event retries from the same seq
+      }
+    }
+    state.refreshing = null;
+  })();
+}
+
+function createMessageCard(message) {
+  const messageCard = createElement("div", "message-card");
+  messageCard.appendChild(createMessagePreview(message));
+  return messageCard;
+}
+
+// "Load more" after the last card while older pages remain
+function appendLoadMore(container, nextCursor) {
+  container.querySelector(".messages-more")?.remove();
+  if (!nextCursor) return;
+
+  const more = createElement("button", "refresh-button messages-more");
+  more.textContent = "Load more";
+  more.addEventListener("click", async () => {
+    more.disabled = true;
+    try {
+      const page = await fetchMessages(nextCursor);
+      more.before(...page.messages.map(createMessageCard));
+      appendLoadMore(container, page.nextCursor);
+    } catch (error) {
+      more.disabled = false;
+    }
+  });
+  container.appendChild(more);
+}
+
+// Resolves once the cards are in place, so pushed messages are added after them
+function displayAllMessages(container, { messages, nextCursor }) {
   // Clear content with smooth transition
   container.style.opacity = "0";
 
-  setTimeout(() => {
+  return new Promise((resolve) => setTimeout(() => {
     container.innerHTML = "";
 
     if (messages.length === 0) {
@@ -65,14 +119,11 @@ function displayAllMessages(container, messages) {
       container.appendChild(noMessagesDiv);
     } else {
       // Create a separate card for each message
-      messages.forEach((message, index) => {
-        const messageCard = createElement("div", "message-card");
-        const preview = createMessagePreview(message);
-        messageCard.appendChild(preview);
-        container.appendChild(messageCard);
-      });
+      container.append(...messages.map(createMessageCard));
+      appendLoadMore(container, nextCursor);
     }
 
     container.style.opacity = "1";
-  }, 150);
+    resolve();
+  }, 150));
 }
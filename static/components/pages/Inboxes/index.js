@@ -36,12 +36,8 @@ export async function renderInboxesPage() {
     const userData = await fetchUserData();
 
     // Extract current quota from user data
-    const maxQuota = Array.isArray(userData.payments)
-      ? userData.payments.reduce(
-          (sum, p) => sum + (typeof p.amount === "number" ? p.amount : 0),
-          USER_STARTING_QUOTA
-        )
-      : USER_STARTING_QUOTA;
+    const maxQuota = USER_STARTING_QUOTA +
+      (typeof userData.purchased_quota === "number" ? userData.purchased_quota : 0);
 
     const inboxQuota =
       typeof userData.inbox_quota === "number" ? userData.inbox_quota : 0;
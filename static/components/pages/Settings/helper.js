@@ -3,7 +3,6 @@ import { QUOTA_PER_USDT } from "../../../utils/constants.js";
 export function updateUserDisplay(userData) {
   const usernameDisplay = document.getElementById("username-display");
   const apiKeyDisplay = document.getElementById("api-key-display");
-  const billingContainer = document.getElementById("billing-transactions");
 
   // 👤 Username
   if (usernameDisplay) {
@@ -12,24 +11,41 @@ export function updateUserDisplay(userData) {
 
   // 🔑 API key
   apiKeyDisplay.textContent = userData.api_key || "Unavailable";
+}
 
-  // 🧾 Billing transactions
-  billingContainer.innerHTML = "";
-  if (userData.payments && userData.payments.length > 0) {
-    userData.payments.forEach((payment) => {
-      const date = new Date(payment.created_at);
-      const formattedDate = `${date.toLocaleDateString()} ${date.toLocaleTimeString([], { hour: "2-digit", minute: "2-digit" })}`;
-      const quota = payment.amount;
-      const usdt = quota / QUOTA_PER_USDT;
-      const txhash = payment.txhash;
-      const txLink = `https://etherscan.io/tx/${txhash}`;
-
-      const entry = document.createElement("div");
-      entry.className = "billing-text";
-      entry.innerHTML = `${formattedDate}   ${quota} quota for ${usdt} USDT via <a href="${txLink}" target="_blank" rel="noopener noreferrer">${txhash.slice(0, 24)}...</a>`;
-      billingContainer.appendChild(entry);
-    });
-  } else {
+// 🧾 Billing transactions: appends a page of payments from /payments/history, with a "Load more" link while pages remain
+export function renderPayments({ payments, nextCursor }, loadMore) {
+  const billingContainer = document.getElementById("billing-transactions");
+  billingContainer.querySelector(".billing-more")?.remove();
+
+  if (payments.length === 0 && !billingContainer.hasChildNodes()) {
     billingContainer.innerHTML = '<div class="billing-text">No transactions found</div>';
+    return;
+  }
+
+  payments.forEach((payment) => {
+    const date = new Date(payment.created_at);
+    const formattedDate = `${date.toLocaleDateString()} ${date.toLocaleTimeString([], { hour: "2-digit", minute: "2-digit" })}`;
+    const quota = payment.amount;
+    const usdt = quota / QUOTA_PER_USDT;
+    const txhash = payment.txhash;
+    const txLink = `https://etherscan.io/tx/${txhash}`;
+
+    const entry = document.createElement("div");
+    entry.className = "billing-text";
+    entry.innerHTML = `${formattedDate}   ${quota} quota for ${usdt} USDT via <a href="${txLink}" target="_blank" rel="noopener noreferrer">${txhash.slice(0, 24)}...</a>`;
+    billingContainer.appendChild(entry);
+  });
+
+  if (nextCursor) {
+    const more = document.createElement("a");
+    more.href = "#";
+    more.className = "billing-text billing-more";
+    more.textContent = "Load more";
+    more.addEventListener("click", (event) => {
+      event.preventDefault();
+      loadMore(nextCursor);
+    });
+    billingContainer.appendChild(more);
   }
-}
\ No newline at end of file
+}
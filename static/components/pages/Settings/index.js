@@ -1,8 +1,8 @@
 import { renderSettingsCards } from "../../molecules/SettingsCards/index.js";
-import { fetchUserData } from "../../../services/apiService.js";
+import { fetchUserData, fetchPaymentHistory } from "../../../services/apiService.js";
 import { LOCAL_STORAGE_KEYS, ROUTES } from "../../../utils/constants.js";
 import { setupSettingsEventListeners } from "../../../events/index.js";
-import { updateUserDisplay } from "./helper.js";
+import { updateUserDisplay, renderPayments } from "./helper.js";
 
 export async function renderSettingsPage() {
   const isLoggedIn = localStorage.getItem(LOCAL_STORAGE_KEYS.IS_LOGGED_IN);
@@ -31,5 +31,15 @@ export async function renderSettingsPage() {
     console.error("User fetch failed:", error);
     localStorage.removeItem(LOCAL_STORAGE_KEYS.IS_LOGGED_IN);
     window.location.href = ROUTES.LOGIN;
+    return;
   }
+
+  const loadPayments = async (cursor) => {
+    try {
+      renderPayments(await fetchPaymentHistory(cursor), loadPayments);
+    } catch (error) {
+      console.error("Payment history fetch failed:", error);
+    }
+  };
+  await loadPayments();
 }
\ No newline at end of file
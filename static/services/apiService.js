@@ -1,4 +1,4 @@
-import { API_BASE_URL } from "../utils/constants.js";
+import { API_BASE_URL, MESSAGES_PAGE_SIZE } from "../utils/constants.js";
 
 // 🔧 Helpers for base64url encoding/decoding
 function bufferDecode(value) {
@@ -24,16 +24,67 @@ export async function fetchUserData() {
   return await response.json();
 }
 
-// 📬 Fetch messages
-export async function fetchMessages() {
-  const response = await fetch(`${API_BASE_URL}/api/messages`, {
+// 🧾 Fetch a page of confirmed payments, newest first
+export async function fetchPaymentHistory(cursor) {
+  const params = new URLSearchParams();
+  if (cursor) params.set("cursor", cursor);
+  const response = await fetch(`${API_BASE_URL}/api/payments/history?${params}`, {
+    credentials: "include",
+  });
+  if (!response.ok) throw new Error("Failed to fetch payment history");
+  return {
+    payments: await response.json(),
+    nextCursor: response.headers.get("X-Next-Cursor"),
+  };
+}
+
+// 📬 Fetch a page of message summaries (no bodies), newest first
+export async function fetchMessages(cursor) {
+  const params = new URLSearchParams({ summary: "1", limit: String(MESSAGES_PAGE_SIZE) });
+  if (cursor) params.set("cursor", cursor);
+  const response = await fetch(`${API_BASE_URL}/api/messages?${params}`, {
     headers: { "Content-Type": "application/json" },
     credentials: "include",
   });
   if (!response.ok) throw new Error("Failed to fetch messages");
+  return {
+    messages: await response.json(),
+    nextCursor: response.headers.get("X-Next-Cursor"),
+  };
+}
+
+// 🆕 Fetch the summaries of messages newer than seq, newest first; usually one page
+export async function fetchMessagesAfter(seq) {
+  const messages = [];
+  let cursor = null;
+  do {
+    const page = await fetchMessages(cursor);
+    const newer = page.messages.filter((message) => message.seq > seq);
+    messages.push(...newer);
+    if (newer.length < page.messages.length) break;
+    cursor = page.nextCursor;
+  } while (cursor);
+  return messages;
+}
+
+// 📄 Fetch one message's full content
+export async function fetchMessage(id) {
+  const response = await fetch(`${API_BASE_URL}/api/message/${encodeURIComponent(id)}`, {
+    credentials: "include",
+  });
+  if (!response.ok) throw new Error("Failed to fetch message");
   return response.json();
 }
 
+// 📡 Subscribe to new message events
+export function subscribeToMessages(onMessage) {
+  const source = new EventSource(`${API_BASE_URL}/api/messages/stream`, {
+    withCredentials: true,
+  });
+  source.addEventListener("message", (event) => onMessage(JSON.parse(event.data)));
+  return source;
+}
+
 // 📥 Fetch inboxes
 export async function fetchInboxes() {
   const response = await fetch(`${API_BASE_URL}/api/inboxes`, {
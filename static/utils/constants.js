@@ -56,3 +56,6 @@ export const LOCAL_STORAGE_KEYS = {
 export const QUOTA_PER_USDT = 10;
 
 export const USER_STARTING_QUOTA = 5;
+
+// Messages listed per page; older pages load on demand
+export const MESSAGES_PAGE_SIZE = 50;